@@ -0,0 +1,77 @@
+# backend/adherence.py
+# ==============================
+# Adherence counters
+# ==============================
+#
+# Given / missed / reverted counts per patient, doctor and nurse per day,
+# bumped by log_history() as events happen so dashboards read a number
+# instead of re-counting history. Days that have been archived are counted
+# once on first request and then kept, since they never change again.
+
+import threading
+from collections import Counter
+
+# history "status" -> counter name
+STATUS_KEYS = {"Given": "given", "Missed": "missed", "Due": "reverted"}
+
+SCOPES = ("patient", "doctor", "nurse")
+
+
+class AdherenceCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}              # (scope, key, date) -> Counter
+        self._days = set()             # dates whose events are all counted
+
+    def record(self, entry, doctor_id=None, nurse_ids=()):
+        name = STATUS_KEYS.get(entry.get("status"))
+        if not name:
+            return
+        date = entry.get("time")
+        keys = [("patient", entry.get("patient_id"))]
+        if doctor_id:
+            keys.append(("doctor", doctor_id))
+        keys.extend(("nurse", nid) for nid in nurse_ids)
+
+        with self._lock:
+            self._days.add(date)
+            for scope, key in keys:
+                counter = self._counts.get((scope, key, date))
+                if counter is None:
+                    counter = self._counts[(scope, key, date)] = Counter()
+                counter[name] += 1
+
+    def rebuild(self, entries, staff_for):
+        """
+        Recounts from scratch; staff_for(patient_id) -> (doctor_id, nurse_ids).
+        """
+        with self._lock:
+            self._counts = {}
+            self._days = set()
+        for entry in entries:
+            self.record(entry, *staff_for(entry.get("patient_id")))
+
+    def load_archived_day(self, day, entries, staff_for):
+        """
+        Counts an archived day the first time it is asked for. Days that
+        were still hot at startup (or since) are already counted.
+        """
+        with self._lock:
+            if day in self._days:
+                return
+            self._days.add(day)
+        for entry in entries:
+            self.record(entry, *staff_for(entry.get("patient_id")))
+
+    def get(self, scope, key, dates):
+        """
+        Summed counts for one patient/doctor/nurse over the given dates.
+        """
+        total = {"given": 0, "missed": 0, "reverted": 0}
+        with self._lock:
+            for date in dates:
+                counter = self._counts.get((scope, key, date))
+                if counter:
+                    for name, n in counter.items():
+                        total[name] += n
+        return total
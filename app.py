@@ -1,40 +1,206 @@
 from flask import Flask, render_template, request, redirect, url_for, session, jsonify
 
 from backend.data_store import doctors, nurses, patients
+from backend.history_journal import HistoryJournal
+from backend.history_db import SQLiteHistoryStore
+from backend.history_writer import HistoryWriter
+from backend.history_cache import HistoryCache
+from backend.history_archive import HistoryArchive, archive_store
+from backend.history_query import page_history_json, parse_cursor, parse_limit
+from backend.history_export import FORMATS, iter_history
+from backend.adherence import AdherenceCounters, SCOPES
+from backend.schedule import compile_schedule, format_minutes, minute_of_day, parse_minutes
+from backend.timer_queue import TimerQueue
+from backend.ward_eval import STATE_NAMES, WardPack, evaluate_ward
+from backend.dose_instances import DoseInstanceTable
+from backend.async_support import ASYNC_MODE, configure as configure_async, run_blocking
+from backend.patient_index import PatientIndex
+from backend.fragment_cache import FragmentCache
+from backend.assets import AssetPipeline
+from backend.compression import ResponseCompressor
+from backend.patient_state import (InProcessStateStore, SQLiteStateStore, acquire_leader,
+                                   live_state)
 from werkzeug.security import check_password_hash
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room
 from datetime import datetime, timedelta
 import pytz, json
+import hashlib
+import uuid
 import json, os
-from flask import Response, make_response
+import atexit
+import threading
+from collections import Counter
+from contextlib import ExitStack
+from flask import Response, make_response, stream_with_context
 
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
 from flask import send_file
 import io
+import mimetypes
 
 
 
 
 
 # ----------------------------- TIMEZONE -----------------------------
+BD = pytz.timezone("Asia/Dhaka")
+
+# ================== LIVE STATE / WORKERS ==================
+# "memory" (default): this process owns all live patient state.
+# "sqlite": live fields go through a shared WAL database so several workers
+# (e.g. gunicorn processes) can serve the same ward. History then has to be
+# the sqlite backend too (it is the default, and the journal is refused),
+# and a Socket.IO message queue (MEDIDISPENSE_SOCKETIO_QUEUE, e.g.
+# redis://localhost:6379/0) lets events emitted by one worker reach
+# clients connected to any other.
+STATE_BACKEND = os.environ.get("MEDIDISPENSE_STATE_BACKEND", "memory").lower()
+STATE_DB = "patient_state.sqlite3"
+STATE_SYNC_INTERVAL = 1.0          # seconds between pulls of other workers' changes
+LEADER_LOCK = "medidispense.leader"
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("MEDIDISPENSE_SOCKETIO_QUEUE") or None
+
+state_store = SQLiteStateStore(STATE_DB) if STATE_BACKEND == "sqlite" else InProcessStateStore()
+
+# Only one worker runs the timer engines and archival; with the in-process
+# store that is always this one.
+leader_lock = acquire_leader(LEADER_LOCK) if state_store.shared else None
+is_leader = leader_lock is not None or not state_store.shared
 
 # ==================== HISTORY SYSTEM ======================
-HISTORY_FILE = "history_store.json"
+HISTORY_FILE = "history_store.json"          # legacy whole-file store (migrated once)
+HISTORY_JOURNAL = "history_journal.jsonl"    # append-only, one record per line
+HISTORY_DB = "history.sqlite3"
+
+# "journal" (default) or "sqlite" — sqlite keeps months of history queryable
+HISTORY_BACKEND = os.environ.get("MEDIDISPENSE_HISTORY_BACKEND",
+                                 "sqlite" if state_store.shared else "journal").lower()
+
+# The journal is one process's file: archival rewrites it with os.replace,
+# losing other workers' appends, and nobody else sees what one appends
+if state_store.shared and HISTORY_BACKEND != "sqlite":
+    raise RuntimeError("MEDIDISPENSE_STATE_BACKEND=sqlite requires "
+                       "MEDIDISPENSE_HISTORY_BACKEND=sqlite")
+
+if HISTORY_BACKEND == "sqlite":
+    history_store = SQLiteHistoryStore(HISTORY_DB)
+    # Carry over whatever the previous backend had recorded
+    if os.path.exists(HISTORY_JOURNAL):
+        history_store.import_entries(HistoryJournal(HISTORY_JOURNAL).iter_entries())
+    else:
+        history_store.migrate_from_json(HISTORY_FILE)
+else:
+    history_store = HistoryJournal(HISTORY_JOURNAL)
+    history_store.migrate_from_json(HISTORY_FILE)
+
+# Archival: only the last HISTORY_HOT_DAYS stay in the live store and in
+# memory; older days go to gzip partitions that are read on demand.
+HISTORY_ARCHIVE_DIR = "history_archive"
+HISTORY_HOT_DAYS = int(os.environ.get("MEDIDISPENSE_HISTORY_HOT_DAYS", "7"))
+
+history_archive = HistoryArchive(HISTORY_ARCHIVE_DIR, blocking=run_blocking)
+
+def archive_cutoff():
+    return (datetime.now(BD).date() - timedelta(days=HISTORY_HOT_DAYS)).isoformat()
+
+# Nothing is writing yet, so the startup pass can run right here
+if is_leader:
+    archive_store(history_store, history_archive, archive_cutoff())
+
+# Group commit: log_history() only queues the entry; a writer thread
+# persists everything queued within the interval as one batch.
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("MEDIDISPENSE_HISTORY_FLUSH_INTERVAL", "0.5"))  # seconds
+HISTORY_FLUSH_SIZE = int(os.environ.get("MEDIDISPENSE_HISTORY_FLUSH_SIZE", "200"))          # entries
+HISTORY_QUEUE_SIZE = 10000
+HISTORY_FLUSH_TIMEOUT = 5.0   # seconds a reader waits for queued history to land
+
+history_writer = HistoryWriter(
+    history_store,
+    flush_interval=HISTORY_FLUSH_INTERVAL,
+    flush_size=HISTORY_FLUSH_SIZE,
+    queue_size=HISTORY_QUEUE_SIZE,
+    blocking=run_blocking,
+).start()
+atexit.register(history_writer.close)
 
 def load_history():
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            return json.load(f)
-    return {}
-
-def save_history(data):
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+    history_writer.flush(HISTORY_FLUSH_TIMEOUT)
+    return history_store.load()
+
+# History pages read through this cache; it only touches disk when the
+# store has changed since the last view.
+history_cache = HistoryCache(
+    history_store,
+    names=lambda pid: patients[pid]["name"] if pid in patients else None,
+    blocking=run_blocking,
+)
+
+# Per-patient set of (date, dose_time, status) keys, so "was this dose
+# already logged today?" is a set lookup instead of a scan of the history.
+history_keys = {}
+
+def index_history(entry):
+    key = (entry.get("time"), entry.get("dose_time"), entry.get("status"))
+    history_keys.setdefault(entry.get("patient_id"), set()).add(key)
+
+def has_history(patient, date, dose_time, status):
+    return (date, dose_time, status) in history_keys.get(patient["patient_id"], ())
+
+def run_archival():
+    """
+    Daily pass: move days that left the hot window to the archive (on the
+    writer thread, so it never races an append) and drop them from memory.
+    """
+    cutoff = archive_cutoff()
+    history_writer.submit_task(lambda: archive_store(history_store, history_archive, cutoff))
+    forget_history_before(cutoff)
+
+
+def forget_history_before(cutoff):
+    """
+    Drops days before `cutoff` (archived by now) from memory and rolls the
+    dose-instance horizon forward.
+    """
+    # Swap each patient's list and keys under its lock so a concurrent
+    # log_history() append lands in the new list, not the discarded one
+    for pid, p in patients.items():
+        with patient_lock(pid):
+            p["history"] = [e for e in p.get("history", []) if (e.get("time") or "") >= cutoff]
+            keys = history_keys.get(pid)
+            if keys:
+                history_keys[pid] = {k for k in keys if (k[0] or "") >= cutoff}
+
+    # Roll the dose-instance horizon forward with the hot window
+    dose_instances.drop_before(BD.localize(datetime.strptime(cutoff, "%Y-%m-%d")))
+    for pid in patients:
+        dose_instances.ensure(pid, get_compiled_schedule(patients[pid]), bd_now().date())
+
+# Given/missed/reverted counts per patient, doctor and nurse per day
+adherence = AdherenceCounters()
+
+# doctor / nurse / room -> patients, kept current on admit/discharge/reassign
+patient_index = PatientIndex()
+patient_index.build(patients, doctors, nurses)
+
+def patient_staff(pid):
+    """
+    (doctor_id, [nurse_ids]) responsible for a patient — used to file
+    adherence counts under the right doctor and nurses.
+    """
+    return patient_index.staff_for(pid)
 
  # Load saved history into memory
-saved_history = load_history()
+history_token = None    # shared history: how far this worker has read
+
+if state_store.shared:
+    # Read through changes_since() so sync_history() carries on from here
+    rows, history_token, _ = history_store.changes_since(None)
+    saved_history = {}
+    for _, entry in rows:
+        saved_history.setdefault(entry["patient_id"], []).append(entry)
+else:
+    saved_history = load_history()
 
 for pid, p in patients.items():
     # Keep patient dictionary intact — ONLY replace its history list
@@ -44,16 +210,31 @@ for pid, p in patients.items():
     if not isinstance(p["history"], list):
         p["history"] = []
 
+    for entry in p["history"]:
+        entry.setdefault("patient_id", pid)
+        index_history(entry)
+
+adherence.rebuild((e for p in patients.values() for e in p["history"]), patient_staff)
+
 
 
 
-BD = pytz.timezone("Asia/Dhaka")
 LOCK_MINUTES = 2
 
 app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Threading by default; serve_async.py runs the same app under eventlet/gevent
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE,
+                    message_queue=SOCKETIO_MESSAGE_QUEUE)
+configure_async(socketio.async_mode)
 app.secret_key = "medidispense_secret_key"
 
+# gzip/brotli for HTML, JSON and exports of at least COMPRESS_MIN_SIZE bytes
+COMPRESS_LEVEL = int(os.environ.get("MEDIDISPENSE_COMPRESS_LEVEL", "6"))            # gzip 1-9
+COMPRESS_MIN_SIZE = int(os.environ.get("MEDIDISPENSE_COMPRESS_MIN_SIZE", "1024"))   # bytes
+
+compressor = ResponseCompressor(level=COMPRESS_LEVEL, min_size=COMPRESS_MIN_SIZE)
+compressor.init_app(app)
+
 
 # ============================= HELPERS ==============================
 
@@ -61,14 +242,14 @@ def bd_now():
     return datetime.now(BD)
 
 
-def log_history(patient, action, status, dose_time=None):
-    now = bd_now()
-
-    # Missed dose event time = scheduled date only
-    if status == "Missed":
-        event_time = now.strftime("%Y-%m-%d")   # date only
-    else:
-        event_time = now.strftime("%Y-%m-%d")   # date only for normal actions too
+def log_history(patient, action, status, dose_time=None, persist=True, date=None):
+    """
+    Records one event in memory and queues it for disk. With persist=False
+    the entry is returned instead, for callers that submit a batch at once.
+    `date` is the dose's scheduled day (default: today).
+    """
+    # Event time = the dose's scheduled date only
+    event_time = date or bd_now().strftime("%Y-%m-%d")
 
     entry = {
         "patient_id": patient["patient_id"],
@@ -79,71 +260,453 @@ def log_history(patient, action, status, dose_time=None):
         "status": status
     }
 
+    apply_history(patient, entry)
+    if state_store.shared:
+        with _own_history_lock:
+            own_history[history_entry_key(entry)] += 1
+
+    # Persisted by the background writer, off the request thread
+    if persist:
+        history_writer.submit(entry)
+    return entry
+
+
+def apply_history(patient, entry):
+    """
+    Adds an entry to this worker's in-memory views of history: the
+    patient's list, the dose keys, adherence counters and dose instances.
+    """
     patient.setdefault("history", [])
     patient["history"].append(entry)
+    index_history(entry)
+    adherence.record(entry, *patient_staff(patient["patient_id"]))
+    dose_instances.record(entry)
 
-    # Save to file
-    all_history = {pid: p.get("history", []) for pid, p in patients.items()}
-    save_history(all_history)
+def nurse_patient_ids(nurse):
+    if not nurse:
+        return []
+    return patient_index.nurse_patients(nurse["nurse_id"])
 
-def refresh_patient_schedule(patient):
-    schedule = patient.get("medication_schedule", [])
-    if not schedule:
-        patient["next_medicine_time"] = None
-        return
 
-    now = bd_now().replace(second=0, microsecond=0)
+def doctor_patient_ids(doctor):
+    if not doctor:
+        return []
+    return patient_index.doctor_patients(doctor["doctor_id"])
+
+
+def session_patient_ids():
+    """
+    Patient IDs visible to the logged-in user, or None if not logged in.
+    """
+    role = session.get("role")
+    user_id = session.get("user_id")
+    if role == "nurse" and user_id in nurses:
+        return nurse_patient_ids(nurses[user_id])
+    if role == "doctor" and user_id in doctors:
+        return doctor_patient_ids(doctors[user_id])
+    return None
+
+
+def state_etag(*parts):
+    """
+    Validator for a response built from live state; `parts` should include
+    every patient version and counter the response shows. RESPONSE_EPOCH
+    covers what the versions can't: a restart and a new deploy.
+    """
+    return hashlib.sha1(repr((RESPONSE_EPOCH,) + parts).encode()).hexdigest()
+
+
+def conditional(tag, build):
+    """
+    304 when the client already has `tag`, otherwise the response from
+    build(). Either way the client is told to revalidate next time.
+    """
+    # Weak comparison: compression turns the ETag weak on the way out
+    if request.if_none_match.contains_weak(tag):
+        response = make_response("", 304)
+    else:
+        response = make_response(build())
+    response.set_etag(tag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
+
+def patient_versions(patient_list):
+    return tuple((p["patient_id"], p.get("version", 0)) for p in patient_list)
+
+
+# Rendered profile / patient-list pages, keyed on the versions they show
+PAGE_CACHE_SIZE = int(os.environ.get("MEDIDISPENSE_PAGE_CACHE_SIZE", "256"))
+page_cache = FragmentCache(PAGE_CACHE_SIZE)
+
+# Nurse and doctor records don't change at runtime today; whatever edits
+# one must call touch_staff() so cached pages showing it are re-rendered.
+staff_versions = {}
+
+
+def touch_staff(kind, staff_id):
+    staff_versions[(kind, staff_id)] = staff_versions.get((kind, staff_id), 0) + 1
+
+
+def staff_version(kind, staff_id):
+    return staff_versions.get((kind, staff_id), 0)
+
+
+def adherence_counts(scope, key, date_from, date_to=None):
+    """
+    Summed counts over a date range; archived days are counted on demand.
+    """
+    start = datetime.strptime(date_from, "%Y-%m-%d").date()
+    end = datetime.strptime(date_to or date_from, "%Y-%m-%d").date()
+    if (end - start).days > 366:
+        raise ValueError("date range too long")
+    dates = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+    for day in history_archive.days(dates[0], dates[-1]) if dates else []:
+        adherence.load_archived_day(day, history_archive.load_day(day), patient_staff)
+
+    return adherence.get(scope, key, dates)
+
+
+# Compiled form of every patient's medication_schedule (sorted minutes +
+# normalized labels). Rebuilt only when the schedule is edited.
+compiled_schedules = {}
+ward_pack = None
+
+def compile_patient_schedule(patient):
+    """
+    (Re)compiles a patient's schedule and rewrites medication_schedule in
+    the normalized, sorted order so current_index lines up with it.
+    """
+    old = patient.get("medication_schedule") or []
     idx = patient.get("current_index", 0)
-    if idx >= len(schedule):
-        idx = 0
-        patient["current_index"] = 0
+    current_label = old[idx] if isinstance(idx, int) and 0 <= idx < len(old) else None
 
-    for _ in range(len(schedule)):  # loop MAX schedule length (no infinite loop)
-        t_str = schedule[idx]
-        t_parsed = datetime.strptime(t_str, "%I:%M %p")
+    global ward_pack
+    compiled = compile_schedule(old)
+    compiled_schedules[patient["patient_id"]] = compiled
+    ward_pack = None    # repacked on the next ward-wide evaluation
+    patient["medication_schedule"] = list(compiled.labels)
+
+    # Keep pointing at the same dose after sorting
+    new_idx = compiled.index_of(current_label) if current_label else None
+    patient["current_index"] = new_idx if new_idx is not None else 0
+    return compiled
+
+
+def get_compiled_schedule(patient):
+    compiled = compiled_schedules.get(patient["patient_id"])
+    if compiled is None:
+        compiled = compile_patient_schedule(patient)
+    return compiled
+
+
+# ---------------------- PER-PATIENT LOCKING ------------------------
+# Every read-modify-write of a patient's live fields (status, current_index,
+# next_medicine_time, schedule) happens under that patient's lock, so
+# different patients update in parallel and the same patient serializes.
+# "version" goes up on every change; clients send back the version they
+# rendered and get a 409 if someone else changed the patient meanwhile.
+
+patient_locks = {pid: threading.RLock() for pid in patients}
+_patient_locks_guard = threading.Lock()
+
+for p in patients.values():
+    p.setdefault("version", 0)
+
+
+def patient_lock(pid):
+    lock = patient_locks.get(pid)
+    if lock is None:
+        with _patient_locks_guard:
+            lock = patient_locks.setdefault(pid, threading.RLock())
+    return lock
+
+
+def bump_version(patient):
+    patient["version"] = patient.get("version", 0) + 1
+    return patient["version"]
+
+
+def live_fields(patient):
+    return (patient.get("status"), patient.get("next_medicine_time"),
+            patient.get("current_index"), patient.get("current_date"))
+
+
+def save_patient(patient, expected):
+    """
+    Publishes a patient's live fields to the state store, if the stored
+    version is still `expected`. On a conflict the local copy is reloaded
+    from the store and False is returned.
+    """
+    pid = patient["patient_id"]
+    if state_store.save(pid, live_state(patient), expected):
+        push_patient_updates([patient])
+        return True
+    apply_state({pid: state_store.load(pid)}, force=True)
+    return False
+
+
+def apply_state(changes, force=False):
+    """
+    Copies live fields written by other workers into `patients`. Returns
+    the patients that changed.
+    """
+    changed = []
+    for pid, fields in changes.items():
+        patient = patients.get(pid)
+        if patient is None or not fields:
+            continue
+        with patient_lock(pid):
+            if not force and fields.get("version", 0) <= patient.get("version", 0):
+                continue
+            reschedule = fields.get("medication_schedule") != patient.get("medication_schedule")
+            patient.update(fields)
+            if reschedule:
+                dose_instances.regenerate(pid, compile_patient_schedule(patient), bd_now())
+        changed.append(patient)
+    return changed
+
+
+state_token = None
+_state_sync_lock = threading.Lock()
+
+
+# Entries this worker logged and applied itself; they are skipped once
+# when sync_history() reads them back from the shared store.
+own_history = Counter()
+_own_history_lock = threading.Lock()
+_history_sync_lock = threading.Lock()
+
+
+def history_entry_key(entry):
+    return tuple(entry.get(f) for f in ("patient_id", "time", "dose_time", "action", "status"))
+
+
+def sync_history():
+    """
+    Applies history other workers logged to this worker's views, so dose
+    keys, adherence counts and dose instances match the shared store.
+    """
+    global history_token
+    with _history_sync_lock:
+        last_id = history_token[1] if history_token else 0
+        rows, history_token, reset = run_blocking(history_store.changes_since, history_token)
+        if reset:
+            # The leader archived old days; ids are never reused, so only
+            # rows past last_id are new
+            forget_history_before(archive_cutoff())
+
+        for row_id, entry in rows:
+            if row_id <= last_id:
+                continue
+            key = history_entry_key(entry)
+            with _own_history_lock:
+                if own_history[key]:
+                    own_history[key] -= 1
+                    continue
+            patient = patients.get(entry["patient_id"])
+            if patient is not None:
+                with patient_lock(entry["patient_id"]):
+                    apply_history(patient, entry)
+
+
+def sync_state():
+    global state_token
+    if not state_store.shared:
+        return []
+    sync_history()
+    with _state_sync_lock:
+        changes, state_token = run_blocking(state_store.changes_since, state_token)
+    return apply_state(changes)
 
-        scheduled_dt = now.replace(
-            hour=t_parsed.hour,
-            minute=t_parsed.minute,
-            second=0,
-            microsecond=0
-        )
 
-        lock_time = scheduled_dt + timedelta(minutes=LOCK_MINUTES)
+def refresh_patient_schedule(patient):
+    with patient_lock(patient["patient_id"]):
+        before = live_fields(patient)
+        version = patient.get("version", 0)
+        _advance_schedule(patient)
+        if live_fields(patient) != before:
+            bump_version(patient)
+            save_patient(patient, version)
+
+
+def slot_at(day, minutes):
+    """
+    Aware datetime of a schedule slot (minutes since midnight) on `day`.
+    """
+    return BD.localize(datetime.combine(day, datetime.min.time())) + timedelta(minutes=minutes)
+
+
+def current_slot(patient, schedule, now):
+    """
+    (index, date, scheduled datetime) of the dose the patient is on.
+    current_date is the day that dose belongs to; state saved without one
+    is taken to be today's.
+    """
+    idx = patient.get("current_index", 0)
+    if not isinstance(idx, int) or not 0 <= idx < len(schedule):
+        idx = 0
+    try:
+        day = datetime.strptime(patient.get("current_date"), "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        day = now.date()
+    return idx, day, slot_at(day, schedule.minutes[idx])
+
+
+def walk_start(patient, schedule, now):
+    """
+    current_slot(), moved up to the archival cutoff if it is older: days
+    before the hot window belong to the archive, where has_history() can't
+    see them, so the schedule walk never starts earlier than that.
+    """
+    idx, day, scheduled_at = current_slot(patient, schedule, now)
+    oldest = datetime.strptime(archive_cutoff(), "%Y-%m-%d").date()
+    if day < oldest:
+        idx, day = 0, oldest
+        scheduled_at = slot_at(day, schedule.minutes[idx])
+    return idx, day, scheduled_at
+
+
+def dose_given(patient, date, dose_time, scheduled_at):
+    """
+    Whether this dose ended up Given (a revert back to Due doesn't count).
+    """
+    row = dose_instances.get(patient["patient_id"], scheduled_at)
+    if row is not None:
+        return row.state == "Given"
+    return has_history(patient, date, dose_time, "Given")
+
+
+def _advance_schedule(patient):
+    schedule = get_compiled_schedule(patient)
+    if not len(schedule):
+        patient["next_medicine_time"] = None
+        return
+
+    now = bd_now().replace(second=0, microsecond=0)
+    idx, day, scheduled_at = walk_start(patient, schedule, now)
+    patient["current_index"] = idx
+
+    # Walks the doses on their real datetimes, day by day, so every slot
+    # that passed while nobody looked is logged; it always ends, at the
+    # latest on tomorrow's first dose, which is still ahead.
+    while True:
+        t_str = schedule.labels[idx]
+        patient["current_date"] = day.isoformat()
 
         # CASE 1 — Too early
-        if now < scheduled_dt:
+        if now < scheduled_at:
             patient["next_medicine_time"] = t_str
             patient["status"] = "Due"
             return
 
         # CASE 2 — Within allowed window
-        if scheduled_dt <= now <= lock_time:
+        if now <= scheduled_at + timedelta(minutes=LOCK_MINUTES):
             patient["next_medicine_time"] = t_str
             return
 
-        # CASE 3 — Missed
-        already_logged = any(
-            h.get("dose_time") == t_str and h.get("status") == "Missed"
-            for h in patient.get("history", [])
-        )
+        # CASE 3 — Missed, unless it was given or is already logged
+        date = day.isoformat()
+        if not (patient["status"] == "Given"
+                or dose_given(patient, date, t_str, scheduled_at)
+                or has_history(patient, date, t_str, "Missed")):
+            log_history(patient, "Missed Dose", "Missed", dose_time=t_str, date=date)
+
+        # move to next dose: after the day's last one, the next day's first (CASE 4)
+        idx += 1
+        if idx == len(schedule):
+            idx, day = 0, day + timedelta(days=1)
+        patient["current_index"] = idx
+        patient["status"] = "Due"
+        scheduled_at = slot_at(day, schedule.minutes[idx])
 
-        if not already_logged and patient["status"] != "Given":
-            log_history(patient, "Missed Dose", "Missed", dose_time=t_str)
 
-        # move to next dose
-        idx = (idx + 1) % len(schedule)
-        patient["current_index"] = idx
+# Workers started after the first pick up the state it has already written
+if state_store.shared:
+    state_store.seed(patients)
+    for pid, fields in state_store.load_all().items():
+        if pid in patients:
+            patients[pid].update(fields)
+    state_token = state_store.changes_since(None)[1]
+
+for p in patients.values():
+    compile_patient_schedule(p)
+
+
+# Concrete (patient, datetime, state) doses for today + DOSE_HORIZON_DAYS,
+# kept in step with history by log_history().
+DOSE_HORIZON_DAYS = 2
+dose_instances = DoseInstanceTable(BD, horizon_days=DOSE_HORIZON_DAYS)
+
+for pid, p in patients.items():
+    dose_instances.ensure(pid, compiled_schedules[pid], bd_now().date())
+    for entry in p["history"]:
+        dose_instances.record(entry)
+
+
+
+
+
+
+
+# ============================== ASSETS ==============================
+# Static files are fingerprinted (plus .gz/.br for text) at startup and
+# served from /assets/<name>.<hash>.<ext> with an immutable cache header;
+# templates link them through asset_url().
+ASSET_BUILD_DIR = "asset_build"
+ASSET_MAX_AGE = 365 * 24 * 3600     # seconds; safe because names change with content
+
+assets = AssetPipeline(app.static_folder, ASSET_BUILD_DIR)
+assets.build()
+
+
+def deploy_hash():
+    """
+    Short hash of the built asset manifest and the template files, so a
+    deploy that changes either changes every ETag.
+    """
+    digest = hashlib.sha1(json.dumps(assets.manifest, sort_keys=True).encode())
+    folder = os.path.join(app.root_path, app.template_folder or "templates")
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            st = os.stat(os.path.join(root, name))
+            digest.update(f"{os.path.relpath(os.path.join(root, name), folder)}:"
+                          f"{st.st_mtime_ns}:{st.st_size}\n".encode())
+    return digest.hexdigest()[:12]
 
-    # CASE 4 — All doses passed → tomorrow's first
-    patient["next_medicine_time"] = schedule[0]
-    patient["status"] = "Due"
 
+# In-process patient versions start again at 0 after a restart, so a tag
+# from before it could match different data; shared workers keep versions
+# in the state db and must agree on tags, so they share one boot id.
+BOOT_ID = "shared" if state_store.shared else uuid.uuid4().hex[:12]
+RESPONSE_EPOCH = f"{BOOT_ID}.{deploy_hash()}"
 
 
+@app.template_global()
+def asset_url(filename):
+    """
+    Fingerprinted URL of a static file (plain static URL if it isn't built).
+    """
+    return assets.url(filename) or url_for("static", filename=filename)
 
 
+@app.route("/assets/<path:filename>")
+def asset(filename):
+    found = assets.resolve(filename, request.headers.get("Accept-Encoding", ""))
+    if found is None:
+        return "Asset not found", 404
+
+    path, encoding = found
+    response = send_file(path,
+                         mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                         max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    return response
 
 
 # ============================ AUTH ROUTES ===========================
@@ -165,7 +728,7 @@ def login():
 
         user = nurses.get(rfid) if role.lower() == "nurse" else doctors.get(rfid)
 
-        if user and check_password_hash(user["password"], password):
+        if user and run_blocking(check_password_hash, user["password"], password):
             session["role"] = role.lower()
             session["user_id"] = rfid
             session["user"] = user
@@ -196,7 +759,9 @@ def nurse_profile(nurse_id):
 
     session["role"] = "nurse"
     session["user"] = nurse
-    return render_template("nurse_profile.html", nurse=nurse)
+    return page_cache.get_or_render(
+        ("nurse_profile", nurse_id, staff_version("nurse", nurse_id)),
+        lambda: render_template("nurse_profile.html", nurse=nurse))
 
 
 @app.route("/nurse_dashboard")
@@ -208,24 +773,20 @@ def nurse_dashboard():
 
     nurse = nurses.get(nurse_id)   # ALWAYS fetch fresh nurse
 
-    assigned_list = nurse.get("assigned_patients", [])
-    if isinstance(assigned_list, str):
-        assigned_list = [assigned_list]
-
-    assigned_patients = []
-    for pid in assigned_list:
-        if pid in patients:
-            p = patients[pid]
-            refresh_patient_schedule(p)
-
-            assigned_patients.append(p)
+    # State is kept current by the transition engine — this is a pure read
+    assigned_patients = [patients[pid] for pid in nurse_patient_ids(nurse)]
+    counts = adherence_counts("nurse", nurse_id, bd_now().strftime("%Y-%m-%d"))
+    last_updated = session.get("nurse_last_action")
 
-    return render_template(
+    tag = state_etag("nurse_dashboard", nurse_id, patient_versions(assigned_patients),
+                     sorted(counts.items()), last_updated)
+    return conditional(tag, lambda: render_template(
         "nurse_dashboard.html",
         nurse=nurse,
         assigned_patients=assigned_patients,
-        last_updated=session.get("nurse_last_action")
-    )
+        adherence=counts,
+        last_updated=last_updated
+    ))
 
 
 
@@ -242,30 +803,30 @@ def nurse_patients():
 
     nurse = nurses.get(nurse_id)
 
-    assigned_list = nurse.get("assigned_patients", [])
-    if isinstance(assigned_list, str):
-        assigned_list = [assigned_list]
+    assigned_patients = [patients[pid] for pid in nurse_patient_ids(nurse)]
 
-    assigned_patients = []
-    for pid in assigned_list:
-        if pid in patients:
-            refresh_patient_schedule(patients[pid])
-            assigned_patients.append(patients[pid])
-
-    return render_template("nurse_patients.html",
-                           nurse=nurse,
-                           assigned_patients=assigned_patients)
+    key = ("nurse_patients", nurse_id, staff_version("nurse", nurse_id),
+           patient_versions(assigned_patients))
+    return page_cache.get_or_render(key, lambda: render_template(
+        "nurse_patients.html",
+        nurse=nurse,
+        assigned_patients=assigned_patients))
 
 
 
 @app.route('/patient/<patient_id>')
 def patient_profile(patient_id):
     patient = patients.get(patient_id)
+    if not patient:
+        return "Patient not found", 404
 
     nurse_id = session.get("nurse_id")
     nurse = nurses.get(nurse_id)
 
-    return render_template("patient_profile.html", patient=patient, nurse=nurse)
+    key = ("patient_profile", patient_id, patient.get("version", 0),
+           nurse_id, staff_version("nurse", nurse_id))
+    return page_cache.get_or_render(
+        key, lambda: render_template("patient_profile.html", patient=patient, nurse=nurse))
 
 
 @app.route("/export_pdf/<patient_id>")
@@ -274,79 +835,84 @@ def export_pdf(patient_id):
     if not patient:
         return "Patient not found", 404
 
-    # Memory buffer for PDF
-    buffer = io.BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=letter)
-    pdf.setTitle(f"{patient_id}_EMR_Report")
-
-    # PDF styling
-    x = 50
-    y = 750
-    line_height = 16
-
-    def write(text, bold=False, space=0):
-        nonlocal y
-        if bold:
-            pdf.setFont("Helvetica-Bold", 12)
-        else:
-            pdf.setFont("Helvetica", 11)
-
-        pdf.drawString(x, y, text)
-        y -= line_height + space
-
-    # HEADER
-    pdf.setFont("Helvetica-Bold", 18)
-    pdf.drawString(50, 800, "MediDispense – Patient Summary Report")
-    pdf.setFont("Helvetica", 12)
-    pdf.drawString(50, 780, f"Patient ID: {patient_id}")
-    pdf.line(50, 775, 560, 775)
-
-    # Patient Basic Info
-    write("=== Patient Information ===", bold=True, space=6)
-    write(f"Name: {patient['name']}")
-    write(f"Gender: {patient['gender']}")
-    write(f"Room: {patient['room']}")
-    write(f"Diagnosis: {patient['diagnosis']}")
-    write("")
-
-    # Vitals
-    vitals = patient.get("vitals", {})
-    write("=== Vitals ===", bold=True, space=6)
-    write(f"Blood Pressure: {vitals.get('bp', '—')}")
-    write(f"Heart Rate: {vitals.get('hr', '—')} bpm")
-    write(f"Temperature: {vitals.get('temp', '—')}°F")
-    write("")
-
-    # Medication Schedule
-    write("=== Medication Schedule ===", bold=True, space=6)
-    write(f"Next Dose: {patient['next_medicine_time']}")
-    write(f"Status: {patient['status']}")
-    write("")
-
-    # Current Medications
-    write("=== Current Medications ===", bold=True, space=6)
-    for med in patient.get("current_medications", []):
-        write(f"- {med}")
-    write("")
-
-    # Ongoing Treatments
-    write("=== Ongoing Treatments ===", bold=True, space=6)
-    for t in patient.get("treatments", []):
-        write(f"- {t}")
-    write("")
-
-    # Allergies
-    write("=== Allergies ===", bold=True, space=6)
-    for a in patient.get("allergies", []):
-        write(f"- {a}")
-    write("")
-
-    # Clinical Notes
-    write("=== Clinical Notes ===", bold=True, space=6)
-    write(patient.get("notes", "No notes available."))
-
-    pdf.save()
-    buffer.seek(0)
+    # Rendering is CPU-bound; keep it off the event loop under an async server
+    def render():
+        # Memory buffer for PDF
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=letter)
+        pdf.setTitle(f"{patient_id}_EMR_Report")
+
+        # PDF styling
+        x = 50
+        y = 750
+        line_height = 16
+
+        def write(text, bold=False, space=0):
+            nonlocal y
+            if bold:
+                pdf.setFont("Helvetica-Bold", 12)
+            else:
+                pdf.setFont("Helvetica", 11)
+
+            pdf.drawString(x, y, text)
+            y -= line_height + space
+
+        # HEADER
+        pdf.setFont("Helvetica-Bold", 18)
+        pdf.drawString(50, 800, "MediDispense – Patient Summary Report")
+        pdf.setFont("Helvetica", 12)
+        pdf.drawString(50, 780, f"Patient ID: {patient_id}")
+        pdf.line(50, 775, 560, 775)
+
+        # Patient Basic Info
+        write("=== Patient Information ===", bold=True, space=6)
+        write(f"Name: {patient['name']}")
+        write(f"Gender: {patient['gender']}")
+        write(f"Room: {patient['room']}")
+        write(f"Diagnosis: {patient['diagnosis']}")
+        write("")
+
+        # Vitals
+        vitals = patient.get("vitals", {})
+        write("=== Vitals ===", bold=True, space=6)
+        write(f"Blood Pressure: {vitals.get('bp', '—')}")
+        write(f"Heart Rate: {vitals.get('hr', '—')} bpm")
+        write(f"Temperature: {vitals.get('temp', '—')}°F")
+        write("")
+
+        # Medication Schedule
+        write("=== Medication Schedule ===", bold=True, space=6)
+        write(f"Next Dose: {patient['next_medicine_time']}")
+        write(f"Status: {patient['status']}")
+        write("")
+
+        # Current Medications
+        write("=== Current Medications ===", bold=True, space=6)
+        for med in patient.get("current_medications", []):
+            write(f"- {med}")
+        write("")
+
+        # Ongoing Treatments
+        write("=== Ongoing Treatments ===", bold=True, space=6)
+        for t in patient.get("treatments", []):
+            write(f"- {t}")
+        write("")
+
+        # Allergies
+        write("=== Allergies ===", bold=True, space=6)
+        for a in patient.get("allergies", []):
+            write(f"- {a}")
+        write("")
+
+        # Clinical Notes
+        write("=== Clinical Notes ===", bold=True, space=6)
+        write(patient.get("notes", "No notes available."))
+
+        pdf.save()
+        buffer.seek(0)
+        return buffer
+
+    buffer = run_blocking(render)
 
     return send_file(
         buffer,
@@ -371,7 +937,9 @@ def doctor_profile(doctor_id):
     session["user_id"] = doctor_id
     session["user"] = doctor
 
-    return render_template("doctor_profile.html", doctor=doctor)
+    return page_cache.get_or_render(
+        ("doctor_profile", doctor_id, staff_version("doctor", doctor_id)),
+        lambda: render_template("doctor_profile.html", doctor=doctor))
 
 
 @app.route("/doctor_dashboard/<doctor_id>")
@@ -382,16 +950,15 @@ def doctor_dashboard(doctor_id):
     doctor = doctors.get(doctor_id)
     session["user_id"] = doctor_id
 
-    assigned_patients = [
-        p for p in patients.values() if p["doctor"] == doctor["name"]
-    ]
-
-    for p in assigned_patients:
-        refresh_patient_schedule(p)
+    assigned_patients = [patients[pid] for pid in doctor_patient_ids(doctor)]
+    counts = adherence_counts("doctor", doctor_id, bd_now().strftime("%Y-%m-%d"))
 
-    return render_template("doctor_dashboard.html",
-                           doctor=doctor,
-                           assigned_patients=assigned_patients)
+    tag = state_etag("doctor_dashboard", doctor_id, patient_versions(assigned_patients),
+                     sorted(counts.items()))
+    return conditional(tag, lambda: render_template("doctor_dashboard.html",
+                                                    doctor=doctor,
+                                                    assigned_patients=assigned_patients,
+                                                    adherence=counts))
 
 
 @app.route("/doctor_my_patients/<doctor_id>")
@@ -402,13 +969,14 @@ def doctor_my_patients(doctor_id):
     doctor = doctors.get(doctor_id)
     session["user_id"] = doctor_id
 
-    assigned_patients = [
-        p for p in patients.values() if p["doctor"] == doctor["name"]
-    ]
+    assigned_patients = [patients[pid] for pid in doctor_patient_ids(doctor)]
 
-    return render_template("doctor_my_patients.html",
-                           doctor=doctor,
-                           assigned_patients=assigned_patients)
+    key = ("doctor_my_patients", doctor_id, staff_version("doctor", doctor_id),
+           patient_versions(assigned_patients))
+    return page_cache.get_or_render(key, lambda: render_template(
+        "doctor_my_patients.html",
+        doctor=doctor,
+        assigned_patients=assigned_patients))
 
 
 @app.route("/doctor_history/<doctor_id>")
@@ -416,22 +984,15 @@ def doctor_history(doctor_id):
     doctor = doctors.get(doctor_id)
     session["user_id"] = doctor_id
 
-    history = []
-    for p in patients.values():
-        if p["doctor"] == doctor["name"]:
-            for h in p["history"]:
-                history.append({
-                    "patient_id": p["patient_id"],
-                    "patient_name": p["name"],
-                    "dose_time": h["dose_time"],
-                    "time": h["time"],
-                    "action": h["action"],
-                    "status": h["status"],
-                })
+    # First page only — the page pulls older entries from /api/history
+    history_writer.flush(HISTORY_FLUSH_TIMEOUT)
+    history_json, next_cursor = page_history_json(history_cache, doctor_patient_ids(doctor),
+                                                  archive=history_archive)
 
     return render_template("doctor_history.html",
                            doctor=doctor,
-                           history_json=json.dumps(history))
+                           history_json=history_json,
+                           next_cursor=next_cursor)
 
 
 
@@ -440,6 +1001,17 @@ def doctor_history(doctor_id):
 
 # ========================= MEDICINE STATUS ===========================
 
+def conflict_response(patient):
+    return jsonify({
+        "success": False,
+        "conflict": True,
+        "message": "This patient was updated elsewhere. Please review and try again.",
+        "status": patient.get("status"),
+        "new_time": patient.get("next_medicine_time"),
+        "version": patient.get("version", 0)
+    }), 409
+
+
 @app.route("/update_medicine_status", methods=["POST"])
 def update_medicine_status():
     try:
@@ -452,95 +1024,220 @@ def update_medicine_status():
 
         patient = patients[patient_id]
 
-        schedule = patient.get("medication_schedule", [])
-        if not schedule or not isinstance(schedule, list):
-            return jsonify({"success": False, "message": "No schedule found"}), 400
+        with patient_lock(patient_id):
+            # Stale page: someone else changed this patient since it was rendered
+            expected = data.get("version")
+            if expected is not None and str(expected) != str(patient.get("version", 0)):
+                return conflict_response(patient)
 
-        # Make sure current_index is safe
-        idx = patient.get("current_index", 0)
-        if not isinstance(idx, int) or idx < 0 or idx >= len(schedule):
-            idx = 0
-            patient["current_index"] = 0
+            schedule = get_compiled_schedule(patient)
+            if not len(schedule):
+                return jsonify({"success": False, "message": "No schedule found"}), 400
 
-        # Current BD time, rounded to the nearest minute
-        now = bd_now().replace(second=0, microsecond=0)
+            # Current BD time, rounded to the nearest minute
+            now = bd_now().replace(second=0, microsecond=0)
 
-        # Current dose time string, e.g. "08:49 PM"
-        t_str = schedule[idx]
-        t_parsed = datetime.strptime(t_str, "%I:%M %p")
+            # Current dose (index made safe), its date and exact datetime
+            idx, day, scheduled_at = current_slot(patient, schedule, now)
+            patient["current_index"] = idx
+            t_str = schedule.labels[idx]    # e.g. "08:49 PM"
 
-        # Scheduled datetime (today at that time, in BD tz)
-        scheduled_dt = now.replace(
-            hour=t_parsed.hour,
-            minute=t_parsed.minute,
-            second=0,
-            microsecond=0
-        )
+            # STRICT WINDOW: from scheduled_at to scheduled_at + LOCK_MINUTES
+            lock_at = scheduled_at + timedelta(minutes=LOCK_MINUTES)
 
-        # STRICT WINDOW: from scheduled_dt to scheduled_dt + LOCK_MINUTES
-        lock_time = scheduled_dt + timedelta(minutes=LOCK_MINUTES)
+            # 🔒 RULE 1 — EARLY: cannot give before scheduled time
+            if now < scheduled_at:
+                return jsonify({
+                    "success": False,
+                    "message": f"Cannot give before scheduled time ({t_str})."
+                })
 
-        # 🔒 RULE 1 — EARLY: cannot give before scheduled time
-        if now < scheduled_dt:
-            return jsonify({
-                "success": False,
-                "message": f"Cannot give before scheduled time ({t_str})."
-            })
+            # 🔒 RULE 2 — LOCKED: more than LOCK_MINUTES after scheduled time
+            # Allowed window is: scheduled_at <= now <= lock_at
+            if now > lock_at:
+                # Marks it Missed (once, unless it was given) and moves on.
+                # With several workers only the leader's engine does this,
+                # so a miss is never logged twice.
+                if is_leader:
+                    refresh_patient_schedule(patient)
+
+                return jsonify({
+                    "success": False,
+                    "locked": True,
+                    "message": "This dose is locked and has been marked as missed.",
+                    "new_time": patient.get("next_medicine_time"),
+                    "version": patient.get("version", 0)
+                })
 
-        # 🔒 RULE 2 — LOCKED: more than LOCK_MINUTES after scheduled time
-        # Allowed window is: scheduled_dt <= now <= lock_time
-        if now > lock_time:
-            # Mark as Missed (only once)
-            already_logged = any(
-                h.get("dose_time") == t_str and h.get("status") == "Missed"
-                for h in patient.get("history", [])
-            )
-            if not already_logged:
-                log_history(patient, "Missed Dose", "Missed", dose_time=t_str)
+            # 🎯 If we reach here, we are inside the allowed window.
+            # Toggle status: Due → Given, Given → Due
+            current_status = patient.get("status", "Due")
+            new_status = "Given" if current_status != "Given" else "Due"
+            version = patient.get("version", 0)
+            patient["status"] = new_status
+            if new_status == "Given":
+                stamp = now.strftime("%Y-%m-%d %I:%M:%S %p")
+                patient["last_updated"] = stamp
+            bump_version(patient)
+
+            # Another worker may have changed this patient since we synced
+            if not save_patient(patient, version):
+                return conflict_response(patient)
+
+            # Log history
+            if new_status == "Given":
+                log_history(patient, "Medicine Given", "Given", dose_time=t_str,
+                            date=day.isoformat())
+                # This is what your dashboard shows at bottom
+                session["nurse_last_action"] = stamp
+            else:
+                log_history(patient, "Status Reverted", "Due", dose_time=t_str,
+                            date=day.isoformat())
 
-            # Move schedule forward & compute next dose
-            refresh_patient_schedule(patient)
+            arm_dose_alert(patient)
+            arm_transition(patient)
 
+            # We do NOT advance to next dose here.
+            # next_medicine_time moves when the transition engine runs
+            # refresh_patient_schedule() as the lock window expires.
             return jsonify({
-                "success": False,
-                "locked": True,
-                "message": "This dose is locked and has been marked as missed.",
-                "new_time": patient.get("next_medicine_time")
+                "success": True,
+                "locked": False,
+                "new_status": new_status,
+                "new_time": patient.get("next_medicine_time"),
+                "last_updated": patient.get("last_updated"),
+                "version": patient.get("version", 0)
             })
 
-        # 🎯 If we reach here, we are inside the allowed window.
-        # Toggle status: Due → Given, Given → Due
-        current_status = patient.get("status", "Due")
-        new_status = "Given" if current_status != "Given" else "Due"
-        patient["status"] = new_status
-
-        # Log history + last_updated
-        if new_status == "Given":
-            log_history(patient, "Medicine Given", "Given", dose_time=t_str)
-            stamp = now.strftime("%Y-%m-%d %I:%M:%S %p")
-            patient["last_updated"] = stamp
-            # This is what your dashboard shows at bottom
-            session["nurse_last_action"] = stamp
-        else:
-            log_history(patient, "Status Reverted", "Due", dose_time=t_str)
-
-        # We do NOT advance to next dose here.
-        # next_medicine_time will move automatically via refresh_patient_schedule()
-        # when the time passes the lock window.
-        return jsonify({
-            "success": True,
-            "locked": False,
-            "new_status": new_status,
-            "new_time": patient.get("next_medicine_time"),
-            "last_updated": patient.get("last_updated")
-        })
-
     except Exception as e:
         print("ERROR in update_medicine_status:", e)
         return jsonify({"success": False, "message": "Server error"}), 500
 
 
 
+MAX_BATCH_ITEMS = 200
+
+
+def item_patient_id(item):
+    """
+    patient_id of a batch item, or None if the item or its ID is malformed.
+    """
+    pid = item.get("patient_id") if isinstance(item, dict) else None
+    return pid if isinstance(pid, str) else None
+
+
+@app.route("/update_medicine_status/batch", methods=["POST"])
+def update_medicine_status_batch():
+    """
+    Confirms several doses as Given in one request (a room on a ward round,
+    or the dispenser). Body: {"items": [{"patient_id", "dose_time"?,
+    "version"?}, ...]}. Each item is checked against its own window; the
+    accepted ones are saved in one state commit and one history batch.
+    dose_time is only for clients that know the server's current slot; it
+    is rejected if it names another one. Unlike the single endpoint this
+    never toggles Given back to Due.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        return jsonify({"success": False, "message": "No items"}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({"success": False,
+                        "message": f"At most {MAX_BATCH_ITEMS} items per batch"}), 400
+
+    now = bd_now().replace(second=0, microsecond=0)
+    stamp = now.strftime("%Y-%m-%d %I:%M:%S %p")
+
+    results = [None] * len(items)
+    accepted = []                   # (result index, patient, dose label, dose date, old version)
+    pids = sorted({item_patient_id(i) for i in items} & patients.keys())
+
+    # Lock every patient involved, always in the same order
+    with ExitStack() as stack:
+        for pid in pids:
+            stack.enter_context(patient_lock(pid))
+
+        seen = set()
+        for n, item in enumerate(items):
+            pid = item_patient_id(item)
+            result = results[n] = {"patient_id": pid, "success": False}
+
+            if pid not in patients:
+                result["message"] = "Invalid patient"
+                continue
+            if pid in seen:
+                result["message"] = "Duplicate patient in batch"
+                continue
+            seen.add(pid)
+
+            patient = patients[pid]
+            result["version"] = patient.get("version", 0)
+            expected = item.get("version")
+            if expected is not None and str(expected) != str(patient.get("version", 0)):
+                result.update(conflict=True, status=patient.get("status"),
+                              message="This patient was updated elsewhere.")
+                continue
+
+            schedule = get_compiled_schedule(patient)
+            if not len(schedule):
+                result["message"] = "No schedule found"
+                continue
+            idx, day, scheduled_at = current_slot(patient, schedule, now)
+            t_str = schedule.labels[idx]
+
+            dose_time = item.get("dose_time")
+            if dose_time is not None and schedule.index_of(dose_time) != idx:
+                result["message"] = f"Not the current dose ({t_str})."
+                continue
+            if now < scheduled_at:
+                result["message"] = f"Cannot give before scheduled time ({t_str})."
+                continue
+            if now > scheduled_at + timedelta(minutes=LOCK_MINUTES):
+                result.update(locked=True, message="This dose is locked.")
+                continue
+            if patient.get("status") == "Given":
+                result.update(success=True, new_status="Given", message="Already given")
+                continue
+
+            accepted.append((n, patient, t_str, day.isoformat(), patient.get("version", 0)))
+            patient["status"] = "Given"
+            patient["last_updated"] = stamp
+            bump_version(patient)
+
+        # One commit for every accepted confirmation
+        saved = state_store.save_many([
+            (patient["patient_id"], live_state(patient), version)
+            for _, patient, _, _, version in accepted
+        ])
+        entries = []
+        for (n, patient, t_str, date, _), ok in zip(accepted, saved):
+            if not ok:
+                apply_state({patient["patient_id"]: state_store.load(patient["patient_id"])},
+                            force=True)
+                results[n].update(conflict=True, status=patient.get("status"),
+                                  version=patient.get("version", 0),
+                                  message="This patient was updated elsewhere.")
+                continue
+            entries.append(log_history(patient, "Medicine Given", "Given",
+                                       dose_time=t_str, date=date, persist=False))
+            results[n].update(success=True, new_status="Given",
+                              new_time=patient.get("next_medicine_time"),
+                              last_updated=stamp, version=patient.get("version", 0))
+            arm_dose_alert(patient)
+            arm_transition(patient)
+
+    history_writer.submit_many(entries)
+    if entries:
+        session["nurse_last_action"] = stamp
+        push_patient_updates([patients[e["patient_id"]] for e in entries])
+
+    return jsonify({
+        "success": all(r["success"] for r in results),
+        "given": len(entries),
+        "results": results
+    })
+
+
 @app.route("/update_manual_time", methods=["POST"])
 def update_manual_time():
     data = request.get_json()
@@ -556,22 +1253,47 @@ def update_manual_time():
 
 
     # Update the medication schedule permanently (OPTION 1)
-    idx = patient.get("current_index", 0)
     try:
         # Validate time format
-        datetime.strptime(new_time, "%I:%M %p")
-    except:
+        new_time = format_minutes(parse_minutes(new_time))
+    except (TypeError, ValueError):
         return jsonify({"success": False, "message": "Invalid time format"}), 400
 
 
-    # Update schedule slot
-    patient["medication_schedule"][idx] = new_time
-    patient["next_medicine_time"] = new_time  # reflect immediately
+    # Update schedule slot, then recompile (the slot may move when sorted)
+    with patient_lock(pid):
+        schedule = get_compiled_schedule(patient)
+        idx = patient.get("current_index", 0)
+        if not isinstance(idx, int) or not 0 <= idx < len(schedule):
+            idx = 0
+
+        # Moving onto another slot's time would merge the two doses into one
+        taken = schedule.index_of(new_time)
+        if taken is not None and taken != idx:
+            return jsonify({"success": False,
+                            "message": f"{new_time} is already in the schedule"}), 400
+
+        version = patient.get("version", 0)
+        if len(schedule):
+            patient["medication_schedule"][idx] = new_time
+        else:
+            patient["medication_schedule"] = [new_time]   # first dose of an empty schedule
+        compiled = compile_patient_schedule(patient)
+        patient["current_index"] = compiled.index_of(new_time)
+        patient["current_date"] = bd_now().strftime("%Y-%m-%d")
+        patient["next_medicine_time"] = new_time  # reflect immediately
+        bump_version(patient)
+        if not save_patient(patient, version):
+            return conflict_response(patient)
+        dose_instances.regenerate(pid, compiled, bd_now())
+        arm_dose_alert(patient)
+        arm_transition(patient)
 
 
     return jsonify({
         "success": True,
-        "new_time": new_time
+        "new_time": new_time,
+        "version": patient["version"]
     })
 
 
@@ -591,51 +1313,476 @@ def nurse_history():
 
     nurse = nurses.get(nurse_id)
 
-    assigned_list = nurse.get("assigned_patients", [])
-    if isinstance(assigned_list, str):
-        assigned_list = [assigned_list]
-
-    saved_history = load_history()
-    history_entries = []
-
-    for pid in assigned_list:
-        if pid in saved_history:
-            for entry in saved_history[pid]:
-                entry.setdefault("patient_id", pid)
-                entry.setdefault("patient_name", patients[pid]["name"])
-                history_entries.append(entry)
-
-    history_entries.sort(key=lambda x: x.get("time", ""), reverse=True)
+    # First page only — the page pulls older entries from /api/history
+    history_writer.flush(HISTORY_FLUSH_TIMEOUT)   # make sure our own recent actions are visible
+    history_json, next_cursor = page_history_json(history_cache, nurse_patient_ids(nurse),
+                                                  archive=history_archive)
 
     return render_template("nurse_history.html",
                            nurse=nurse,
-                           history_json=json.dumps(history_entries))
+                           history_json=history_json,
+                           next_cursor=next_cursor)
+
+
+@app.route("/api/history")
+def api_history():
+    """
+    Paged history for the logged-in nurse/doctor's patients.
+    Query args: patient, status, date_from, date_to, q, cursor, limit.
+    """
+    patient_ids = session_patient_ids()
+    if patient_ids is None:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    patient_id = request.args.get("patient")
+    if patient_id:
+        patient_ids = [patient_id] if patient_id in patient_ids else []
+
+    history_writer.flush(HISTORY_FLUSH_TIMEOUT)
+    items_json, next_cursor = page_history_json(
+        history_cache,
+        patient_ids,
+        status=request.args.get("status"),
+        date_from=request.args.get("date_from"),
+        date_to=request.args.get("date_to"),
+        search=request.args.get("q"),
+        cursor=parse_cursor(request.args.get("cursor")),
+        limit=parse_limit(request.args.get("limit")),
+        archive=history_archive,
+    )
+
+    # Items are spliced in as already-encoded JSON
+    body = '{"success": true, "items": %s, "next_cursor": %s}' % (items_json, json.dumps(next_cursor))
+    return Response(body, mimetype="application/json")
  
 
-# ---------------- SCHEDULE CHECKER (RUNS EVERY 30 SECONDS) ------------------
-from threading import Thread
-import time
+@app.route("/export/history.<fmt>")
+def export_history(fmt):
+    """
+    Streams the logged-in nurse/doctor's patients' history as CSV or
+    NDJSON. Filters: doctor, nurse, patient, status, date_from, date_to, q.
+    Rows are sent as they are read.
+    """
+    if fmt not in FORMATS:
+        return "Unknown export format", 404
+    visible = session_patient_ids()
+    if visible is None:
+        return redirect(url_for("login"))
 
-def schedule_monitor():
-    while True:
-        now = bd_now().strftime("%I:%M %p")
-
-        for pid, patient in patients.items():
-            # Compare next_medicine_time with current time
-            if patient.get("next_medicine_time") == now:
-                socketio.emit("medicine_alert", {
-                    "patient_id": pid,
-                    "patient_name": patient["name"],
-                    "room": patient["room"],
-                    "time": now
-                })
+    # Only ever the logged-in user's own patients, narrowed by the filters
+    patient_ids = set(visible)
+    doctor_id = request.args.get("doctor")
+    nurse_id = request.args.get("nurse")
+    patient_id = request.args.get("patient")
+    if doctor_id:
+        patient_ids &= set(doctor_patient_ids(doctors.get(doctor_id)))
+    if nurse_id:
+        patient_ids &= set(nurse_patient_ids(nurses.get(nurse_id)))
+    if patient_id:
+        patient_ids &= {patient_id}
+
+    filters = {
+        "patient_ids": patient_ids,
+        "status": request.args.get("status") or None,
+        "date_from": request.args.get("date_from") or None,
+        "date_to": request.args.get("date_to") or None,
+        "search": request.args.get("q"),
+    }
+    encode, mimetype = FORMATS[fmt]
+    names = {pid: p["name"] for pid, p in patients.items()}
+
+    def generate():
+        history_writer.flush(HISTORY_FLUSH_TIMEOUT)
+        entries = iter_history(history_store, history_archive, **filters)
+        for chunk in encode(entries, names):
+            yield chunk
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=medicine_history.{fmt}"
+    return response
+
+
+@app.route("/api/adherence")
+def api_adherence():
+    """
+    Given/missed/reverted counts. Query args: scope (patient|doctor|nurse),
+    id, and date or date_from/date_to (default: today). Without scope/id,
+    the logged-in nurse or doctor. Only the user's own counts and their
+    patients' are readable.
+    """
+    patient_ids = session_patient_ids()
+    if patient_ids is None:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    scope = request.args.get("scope") or session.get("role")
+    key = request.args.get("id") or session.get("user_id")
+    if scope not in SCOPES:
+        return jsonify({"success": False, "message": "Invalid scope"}), 400
+    if scope == "patient":
+        allowed = key in patient_ids
+    else:
+        allowed = scope == session.get("role") and key == session.get("user_id")
+    if not allowed:
+        return jsonify({"success": False, "message": "Invalid id"}), 400
+
+    today = bd_now().strftime("%Y-%m-%d")
+    date_from = request.args.get("date_from") or request.args.get("date") or today
+    date_to = request.args.get("date_to") or request.args.get("date") or date_from
+    try:
+        counts = adherence_counts(scope, key, date_from, date_to)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid date range"}), 400
 
-        time.sleep(30)   # check every 30 seconds
+    return jsonify({
+        "success": True,
+        "scope": scope,
+        "id": key,
+        "date_from": date_from,
+        "date_to": date_to,
+        "counts": counts
+    })
+
+
+@app.route("/api/patients")
+def api_patients():
+    """
+    Live fields of the logged-in user's patients. Sends an ETag over the
+    patient versions, so an unchanged poll is a 304.
+    """
+    patient_ids = session_patient_ids()
+    if patient_ids is None:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    shown = [patients[pid] for pid in patient_ids]
+    tag = state_etag("api_patients", patient_versions(shown))
+    return conditional(tag, lambda: jsonify({
+        "success": True,
+        "patients": [dict(patient_delta(p), name=p["name"], room=p.get("room")) for p in shown]
+    }))
+
+
+@app.route("/api/ward_status")
+def api_ward_status():
+    """
+    Due / open / done state, next dose and overdue minutes for every
+    patient, evaluated for the whole ward at once. ?room= limits the
+    rows to one room.
+    """
+    global ward_pack
+    if session_patient_ids() is None:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    pack = ward_pack
+    if pack is None or len(pack) != len(patients):
+        pack = ward_pack = WardPack(list(patients), compiled_schedules)
+
+    now = bd_now()
+    today = now.date()
+    now_min = minute_of_day(now)
+    indices, days, given = [], [], []
+    for pid, schedule in zip(pack.patient_ids, pack.schedules):
+        idx, day = 0, today
+        if len(schedule):
+            idx, day, _ = walk_start(patients[pid], schedule, now)
+        indices.append(idx)
+        days.append((day - today).days)
+        given.append(patients[pid].get("status") == "Given")
+    state, next_index, next_day, missed, overdue = evaluate_ward(
+        pack, indices, days, now_min, LOCK_MINUTES, given)
+
+    room = request.args.get("room")
+    in_room = set(patient_index.room_patients(room)) if room else None
+
+    ward = []
+    for row, pid in enumerate(pack.patient_ids):
+        if in_room is not None and pid not in in_room:
+            continue
+        schedule = pack.schedules[row]
+        ward.append({
+            "patient_id": pid,
+            "room": patients[pid].get("room"),
+            "state": STATE_NAMES[int(state[row])],
+            "next_time": schedule.labels[int(next_index[row])] if len(schedule) else None,
+            "next_date": ((today + timedelta(days=int(next_day[row]))).isoformat()
+                          if len(schedule) else None),
+            "missed": int(missed[row]),
+            "overdue_minutes": int(overdue[row]),
+        })
+
+    return jsonify({"success": True, "time": format_minutes(now_min), "patients": ward})
+
+
+@app.route("/api/dose_instances")
+def api_dose_instances():
+    """
+    Concrete doses for one patient. Query args: patient, and either
+    date + time (a single dose) or date_from/date_to (default: today).
+    """
+    patient_ids = session_patient_ids()
+    if patient_ids is None:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    pid = request.args.get("patient")
+    if pid not in patient_ids:
+        return jsonify({"success": False, "message": "Invalid patient"}), 400
+
+    today = bd_now().strftime("%Y-%m-%d")
+    try:
+        if request.args.get("date") and request.args.get("time"):
+            row = dose_instances.get(pid, dose_instances.at(request.args["date"],
+                                                            request.args["time"]))
+            rows = [row] if row else []
+        else:
+            start = dose_instances.at(request.args.get("date_from") or today, "12:00 AM")
+            end = dose_instances.at(request.args.get("date_to") or
+                                    request.args.get("date_from") or today, "12:00 AM")
+            rows = dose_instances.between(start, end + timedelta(days=1), patient_id=pid)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid date or time"}), 400
+
+    return jsonify({"success": True, "doses": [r.to_dict() for r in rows]})
+
+
+@app.route("/api/cache_stats")
+def cache_stats():
+    return jsonify({"history": history_cache.stats(), "pages": page_cache.stats(),
+                    "compression": compressor.stats()})
+
+
+# ---------------- DOSE ALERT SCHEDULER ------------------
+# One heap entry per patient, keyed on the exact datetime of its next dose;
+# the scheduler thread sleeps until the earliest one instead of polling.
+
+def next_dose_at(patient, after):
+    """
+    First scheduled dose strictly after `after` (an aware datetime), today
+    or tomorrow, or None if the patient has no schedule.
+    """
+    schedule = get_compiled_schedule(patient)
+    if not len(schedule):
+        return None
+    for offset in (0, 1):
+        midnight = BD.localize(datetime.combine(after.date() + timedelta(days=offset),
+                                                datetime.min.time()))
+        for m in schedule.minutes:
+            at = midnight + timedelta(minutes=m)
+            if at > after:
+                return at
+    return None
+
+
+# patient_id -> datetime of the last dose alert sent, so re-arming within
+# the dose's own minute doesn't announce it twice
+last_alerted = {}
+
+
+def arm_dose_alert(patient, after=None):
+    if after is None:
+        # A dose due in the current minute still gets its alert (it fires
+        # right away), unless it already had one or has been given
+        now = bd_now()
+        after = now.replace(second=0, microsecond=0) - timedelta(microseconds=1)
+        fired = last_alerted.get(patient["patient_id"])
+        if fired is not None and fired > after:
+            after = fired
+    at = next_dose_at(patient, after)
+    if at is not None and at <= bd_now() and dose_given(
+            patient, at.date().isoformat(), at.strftime("%I:%M %p"), at):
+        at = next_dose_at(patient, at)
+    if at is None:
+        alert_scheduler.cancel(patient["patient_id"])
+    else:
+        alert_scheduler.arm(patient["patient_id"], at.timestamp(), at)
+
+
+def arm_archival():
+    tomorrow = (bd_now() + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    alert_scheduler.arm(ARCHIVAL_JOB, tomorrow.timestamp(), tomorrow)
+
+
+def fire_due(due):
+    batches = {}                     # socket rooms -> [alert, ...]
+    for key, _, at in due:
+        if key == ARCHIVAL_JOB:
+            run_archival()
+            arm_archival()
+            continue
+
+        patient = patients.get(key)
+        if not patient:
+            continue
+        alert = {
+            "patient_id": key,
+            "patient_name": patient["name"],
+            "room": patient["room"],
+            "time": at.strftime("%I:%M %p")
+        }
+        for room in alert_rooms(key):
+            batches.setdefault(room, []).append(alert)
+        # Exactly once per dose: the next arming starts after this one
+        last_alerted[key] = at
+        arm_dose_alert(patient, after=at)
+
+    # One message per recipient, however many doses fell due together
+    for room, alerts in batches.items():
+        socketio.emit("medicine_alerts", {"alerts": alerts}, to=room)
+
+
+# ------------------------- SOCKET ROOMS ---------------------------
+# Each socket joins exactly one room, nurse:<id> or doctor:<id>, so a
+# payload built per room reaches every user once and carries everything
+# that concerns them. Nurses covering a ward room are looked up here
+# rather than through a shared room:<ward> socket room.
+
+nurse_ids_by_room = {}
+for nid, n in nurses.items():
+    if n.get("assigned_room"):
+        nurse_ids_by_room.setdefault(n["assigned_room"], []).append(nid)
+
+
+def alert_rooms(pid):
+    doctor_id, nurse_ids = patient_staff(pid)
+    nurse_ids = set(nurse_ids).union(nurse_ids_by_room.get(patients[pid].get("room"), ()))
+    rooms = [f"nurse:{nid}" for nid in sorted(nurse_ids)]
+    if doctor_id:
+        rooms.append(f"doctor:{doctor_id}")
+    return rooms
+
+
+def patient_delta(patient):
+    return {
+        "patient_id": patient["patient_id"],
+        "status": patient.get("status"),
+        "next_medicine_time": patient.get("next_medicine_time"),
+        "last_updated": patient.get("last_updated"),
+        "version": patient.get("version", 0)
+    }
+
+
+def push_patient_updates(changed):
+    """
+    Sends the live fields of changed patients to the staff watching them,
+    one patient_updates message per recipient room, so dashboards patch
+    rows in place instead of reloading.
+    """
+    batches = {}
+    for patient in changed:
+        delta = patient_delta(patient)
+        for room in alert_rooms(patient["patient_id"]):
+            batches.setdefault(room, []).append(delta)
+    for room, updates in batches.items():
+        socketio.emit("patient_updates", {"updates": updates}, to=room)
+
+
+@socketio.on("connect")
+def on_connect(auth=None):
+    role, user_id = session.get("role"), session.get("user_id")
+    if role == "nurse" and user_id in nurses:
+        join_room(f"nurse:{user_id}")
+    elif role == "doctor" and user_id in doctors:
+        join_room(f"doctor:{user_id}")
+    else:
+        return False
+
+
+# ---------------- DOSE TRANSITION ENGINE ------------------
+# Moves each patient's dose state (Due → window open → Missed → next slot)
+# at the exact instants it changes, so missed doses are recorded even for
+# patients nobody is looking at and dashboards only have to read state.
+
+def next_transition_at(patient, after):
+    """
+    Next instant strictly after `after` at which refresh_patient_schedule()
+    would produce a different result: a window opening, or the first minute
+    past a window's LOCK_MINUTES lock.
+    """
+    schedule = get_compiled_schedule(patient)
+    if not len(schedule):
+        return None
+    candidates = []
+    for offset in (-1, 0, 1):    # a late-evening lock can expire after midnight
+        midnight = BD.localize(datetime.combine(after.date() + timedelta(days=offset),
+                                                datetime.min.time()))
+        for m in schedule.minutes:
+            for delta in (m, m + LOCK_MINUTES + 1):
+                at = midnight + timedelta(minutes=delta)
+                if at > after:
+                    candidates.append(at)
+    return min(candidates) if candidates else None
+
+
+def arm_transition(patient, after=None):
+    at = next_transition_at(patient, after or bd_now())
+    if at is None:
+        transition_engine.cancel(patient["patient_id"])
+    else:
+        transition_engine.arm(patient["patient_id"], at.timestamp(), at)
+
+
+def fire_transitions(due):
+    for pid, _, at in due:
+        patient = patients.get(pid)
+        if not patient:
+            continue
+        refresh_patient_schedule(patient)
+        arm_transition(patient, after=at)
+
+
+transition_engine = TimerQueue(fire_transitions, name="dose-transitions")
+
+ARCHIVAL_JOB = "__archival__"   # daily archive pass shares the alert heap
 
-# Start background task
-thread = Thread(target=schedule_monitor)
-thread.daemon = True
-thread.start()
+alert_scheduler = TimerQueue(fire_due, name="dose-alerts")
+
+
+def start_engines():
+    for p in patients.values():
+        refresh_patient_schedule(p)     # catch up on anything missed while down
+        arm_transition(p)
+    transition_engine.start(spawn=socketio.start_background_task)
+
+    for p in patients.values():
+        arm_dose_alert(p)
+    arm_archival()
+    alert_scheduler.start(spawn=socketio.start_background_task)
+
+
+# --------------------------- WORKER SYNC ----------------------------
+# With a shared state store every worker pulls other workers' changes before
+# each request; the leader also polls, so it can re-arm timers for patients
+# changed elsewhere. Followers keep trying the leader lock and take over the
+# engines if the leader goes away. The sqlite reads behind sync_state() go
+# through run_blocking(), so under eventlet/gevent a request waiting on
+# them doesn't hold up every other connection.
+
+@app.before_request
+def pull_shared_state():
+    sync_state()
+
+
+def state_sync_loop():
+    global leader_lock, is_leader
+    while True:
+        socketio.sleep(STATE_SYNC_INTERVAL)
+        try:
+            changed = sync_state()
+            if not is_leader:
+                leader_lock = acquire_leader(LEADER_LOCK)
+                if leader_lock is None:
+                    continue
+                is_leader = True
+                start_engines()
+            for p in changed:
+                arm_dose_alert(p)
+                arm_transition(p)
+        except Exception as e:
+            print("ERROR in state sync:", e)
+
+
+if is_leader:
+    start_engines()
+if state_store.shared:
+    socketio.start_background_task(state_sync_loop)
 
 
 # ============================== RUN ================================
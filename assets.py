@@ -0,0 +1,127 @@
+# backend/assets.py
+# ==============================
+# Static asset pipeline
+# ==============================
+#
+# Copies every file under the static folder to a build directory under a
+# content-hashed name (bg_medical.jpg -> bg_medical.3f2a9c1d04e7.jpg), with
+# .gz and, when the brotli module is installed, .br siblings for text
+# assets. Because a hashed name can never change content, those URLs are
+# served with a one-year immutable cache header and tablets only download
+# an asset again when it actually changes. Images are already compressed,
+# so they are fingerprinted but not re-compressed.
+#
+# Runs at app startup; can also be run ahead of time:
+#     python -m backend.assets <static dir> <build dir>
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+try:
+    import brotli
+    HAVE_BROTLI = True
+except ImportError:
+    HAVE_BROTLI = False
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".html", ".json", ".txt", ".map"}
+MANIFEST = "manifest.json"
+HASH_LENGTH = 12
+
+
+class AssetPipeline:
+    def __init__(self, source_dir, build_dir, compresslevel=9):
+        self.source_dir = source_dir
+        self.build_dir = os.path.abspath(build_dir)
+        self.compresslevel = compresslevel
+        self.manifest = {}          # "images1/bg_medical.jpg" -> hashed relative path
+        self._served = set()        # hashed relative paths we may serve
+
+    # ----------------------------- BUILD ---------------------------
+
+    def build(self):
+        """
+        Fingerprints and compresses everything under source_dir. Files
+        already built (same hash) are left alone, so restarts are cheap.
+        """
+        manifest = {}
+        if os.path.isdir(self.source_dir):
+            for root, _, files in os.walk(self.source_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    logical = os.path.relpath(path, self.source_dir).replace(os.sep, "/")
+                    manifest[logical] = self._build_one(path, logical)
+
+        os.makedirs(self.build_dir, exist_ok=True)
+        _write_atomic(os.path.join(self.build_dir, MANIFEST),
+                      json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+        self.manifest = manifest
+        self._served = set(manifest.values())
+        return manifest
+
+    def _build_one(self, path, logical):
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        stem, ext = os.path.splitext(logical)
+        hashed = f"{stem}.{digest}{ext}"
+
+        out = os.path.join(self.build_dir, hashed)
+        if not os.path.exists(out):
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            _write_atomic(out, data)
+        if ext.lower() in COMPRESSIBLE:
+            if not os.path.exists(out + ".gz"):
+                _write_atomic(out + ".gz", gzip.compress(data, self.compresslevel, mtime=0))
+            if HAVE_BROTLI and not os.path.exists(out + ".br"):
+                _write_atomic(out + ".br", brotli.compress(data, quality=11))
+        return hashed
+
+    # ----------------------------- SERVE ---------------------------
+
+    def url(self, logical, prefix="/assets/"):
+        """
+        Hashed URL for a static file, or None if it isn't in the build.
+        """
+        hashed = self.manifest.get(logical)
+        return prefix + hashed if hashed else None
+
+    def resolve(self, hashed, accept_encoding=""):
+        """
+        (path on disk, content encoding or None) of the best variant of a
+        hashed asset for the client's Accept-Encoding, or None if unknown.
+        """
+        if hashed not in self._served:
+            return None
+        path = os.path.join(self.build_dir, hashed)
+        accepted = {token.split(";")[0].strip() for token in accept_encoding.lower().split(",")}
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding in accepted and os.path.exists(path + suffix):
+                return path + suffix, encoding
+        return path, None
+
+
+def _write_atomic(path, data):
+    # Every worker builds at startup, so each writer needs its own temp
+    # file; whoever renames last wins, and the contents are identical.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                               prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m backend.assets <static dir> <build dir>")
+    built = AssetPipeline(sys.argv[1], sys.argv[2]).build()
+    for logical, hashed in sorted(built.items()):
+        print(f"{logical} -> {hashed}")
@@ -0,0 +1,40 @@
+# backend/async_support.py
+# ==============================
+# Async server helpers
+# ==============================
+#
+# Under eventlet or gevent every dashboard socket is a green thread on one
+# OS thread, so anything that blocks in C (bcrypt/pbkdf2 password checks,
+# fsync, sqlite, reportlab) would stall every connection at once. Such calls
+# go through run_blocking(), which hands them to the async library's native
+# thread pool, and is a plain call in threading mode.
+
+import os
+
+# "threading" (default), "eventlet" or "gevent"; serve_async.py sets it
+# before the app is imported.
+ASYNC_MODE = os.environ.get("MEDIDISPENSE_ASYNC_MODE") or None
+
+_mode = "threading"
+
+
+def configure(mode):
+    """
+    Called once with socketio.async_mode after the server is created.
+    """
+    global _mode
+    _mode = mode or "threading"
+
+
+def run_blocking(fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) without blocking the event loop and returns
+    its result (exceptions propagate to the caller).
+    """
+    if _mode == "eventlet":
+        from eventlet import tpool
+        return tpool.execute(fn, *args, **kwargs)
+    if _mode in ("gevent", "gevent_uwsgi"):
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
@@ -0,0 +1,177 @@
+# backend/compression.py
+# ==============================
+# Response compression
+# ==============================
+#
+# History pages embed large JSON arrays and big-ward dashboards run to
+# hundreds of KB of HTML, all of which compresses 5-10x. This after_request
+# hook gzips (or brotli-compresses, when the module is installed and the
+# client accepts it) text responses above a minimum size. Streamed
+# responses (CSV/NDJSON exports) are compressed chunk by chunk and flushed
+# every couple of KB, so rows keep reaching the client as they are read.
+# Responses that already carry a Content-Encoding, files sent with
+# send_file() and non-text types are left alone.
+
+import threading
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+    HAVE_BROTLI = True
+except ImportError:
+    HAVE_BROTLI = False
+
+COMPRESSIBLE_TYPES = {
+    "text/html", "text/css", "text/plain", "text/csv", "text/javascript",
+    "application/json", "application/javascript", "application/x-ndjson",
+    "image/svg+xml",
+}
+
+
+def accepted_encodings(header):
+    """
+    {"gzip": 1.0, "br": 0.8, ...} from an Accept-Encoding header.
+    """
+    result = {}
+    for token in (header or "").lower().split(","):
+        name, _, params = token.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[name.strip()] = q
+    return result
+
+
+class ResponseCompressor:
+    def __init__(self, level=6, min_size=1024, brotli_quality=5, stream_flush_size=2048):
+        self.level = level                    # gzip 1-9
+        self.min_size = min_size              # bytes; smaller bodies go out as-is
+        self.brotli_quality = brotli_quality  # brotli 0-11
+        self.stream_flush_size = stream_flush_size  # input bytes between stream flushes
+        self._lock = threading.Lock()
+        self.responses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def init_app(self, app):
+        app.after_request(self.compress)
+
+    # --------------------------- NEGOTIATE -------------------------
+
+    def choose(self, header):
+        """
+        The supported encoding with the highest q-value ("*" covers any not
+        named); brotli wins a tie. None if nothing acceptable is left.
+        """
+        accepted = accepted_encodings(header)
+        wildcard = accepted.get("*", 0)
+        best, best_q = None, 0
+        for encoding in (("br", "gzip") if HAVE_BROTLI else ("gzip",)):
+            q = accepted.get(encoding, wildcard)
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def _compressor(self, encoding):
+        if encoding == "br":
+            return brotli.Compressor(quality=self.brotli_quality)
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)   # 31: gzip container
+
+    # ---------------------------- COMPRESS -------------------------
+
+    def compress(self, response):
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = self.choose(request.headers.get("Accept-Encoding"))
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._stream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            compressor = self._compressor(encoding)
+            packed = compressor.compress(data) + _finish(compressor)
+            if len(packed) >= len(data):
+                return response
+            response.set_data(packed)
+            self._count(len(data), len(packed))
+
+        response.headers["Content-Encoding"] = encoding
+        # The bytes differ from the uncompressed variant's
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _stream(self, chunks, encoding):
+        compressor = self._compressor(encoding)
+        size_in = size_out = pending = 0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                size_in += len(chunk)
+                pending += len(chunk)
+                packed = compressor.compress(chunk)
+                # The compressor holds output back until it has a full
+                # block; flush so the rows read so far go out now
+                if pending >= self.stream_flush_size:
+                    packed += _flush(compressor)
+                    pending = 0
+                if packed:
+                    size_out += len(packed)
+                    yield packed
+            tail = _finish(compressor)
+            size_out += len(tail)
+            yield tail
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            self._count(size_in, size_out)
+
+    # ----------------------------- STATS ---------------------------
+
+    def _count(self, size_in, size_out):
+        with self._lock:
+            self.responses += 1
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+
+    def stats(self):
+        with self._lock:
+            return {
+                "responses": self.responses,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "brotli": HAVE_BROTLI,
+            }
+
+
+def _flush(compressor):
+    # Everything compressed so far, without ending the stream
+    if hasattr(compressor, "finish"):
+        return compressor.flush()
+    return compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _finish(compressor):
+    # zlib objects flush(), brotli.Compressor finish()
+    return compressor.finish() if hasattr(compressor, "finish") else compressor.flush()
@@ -82,6 +82,7 @@ def human_dt(dt: datetime):
 # ========================
 patients_data = {}           # raw from Flask
 current_selection = None     # dict with selected dose info
+current_due = []             # every patient's dose inside the due window
 
 def fetch_schedule():
     global patients_data
@@ -135,6 +136,20 @@ def pick_next_due(doses):
     # else: pick soonest upcoming
     return doses[0]
 
+def due_now(doses):
+    """
+    The doses inside DUE_WINDOW_MIN, one per patient (the server confirms
+    each patient's current dose), soonest first.
+    """
+    n = now_local()
+    window = timedelta(minutes=DUE_WINDOW_MIN)
+    seen, due = set(), []
+    for d in doses:
+        if d["next_dt"] - n <= window and d["patient_id"] not in seen:
+            seen.add(d["patient_id"])
+            due.append(d)
+    return due
+
 # ========================
 # UI
 # ========================
@@ -193,9 +208,10 @@ footer.pack(side="bottom", pady=6)
 # ========================
 # UI Actions
 # ========================
-def set_selection(sel):
-    global current_selection
+def set_selection(sel, due=()):
+    global current_selection, current_due
     current_selection = sel
+    current_due = list(due)
     if not sel:
         status_label.config(text="No upcoming doses found.")
         patient_label.config(text="—")
@@ -206,7 +222,9 @@ def set_selection(sel):
     n = now_local()
     mins = int((sel["next_dt"] - n).total_seconds() // 60)
     when_txt = "due now" if mins <= 0 else f"in {mins} min"
-    status_label.config(text=f"Next dose {when_txt}")
+    more = len(current_due) - 1
+    more_txt = f"  (+{more} more due, Confirm Given covers all)" if more > 0 else ""
+    status_label.config(text=f"Next dose {when_txt}{more_txt}")
     patient_label.config(text=f"{sel['patient_name']}  ({sel['patient_id']})")
     diagnosis_label.config(text=f"Diagnosis: {sel['diagnosis'] or '—'}")
     time_label.config(text=f"{sel['time_label']}: {sel['time_str']}  →  {human_dt(sel['next_dt'])}")
@@ -214,7 +232,7 @@ def set_selection(sel):
 def ui_tick():
     # recompute next due from current patients_data
     doses = expand_all_doses(patients_data)
-    set_selection(pick_next_due(doses))
+    set_selection(pick_next_due(doses), due_now(doses))
     root.after(UI_TICK_SEC * 1000, ui_tick)
 
 def thread_fetch_loop():
@@ -245,20 +263,40 @@ def do_dispense():
 
     status_label.config(text="Dispensing complete ✅")
 
+def confirm_given_many(doses):
+    """
+    Confirms several doses in one request.
+    doses: [{'patient_id', ...}] -> per-dose results from the server.
+    No dose_time is sent: our medicine_time map isn't the server's
+    schedule, so the server confirms whichever dose is current.
+    """
+    items = [{"patient_id": d["patient_id"]} for d in doses]
+    r = requests.post(f"{FLASK_SERVER}/update_medicine_status/batch",
+                      json={"items": items},
+                      timeout=6)
+    return r.json().get("results", [])
+
 def do_confirm_given():
     if not current_selection:
         messagebox.showwarning("No Patient", "No upcoming dose selected.")
         return
-    pid = current_selection["patient_id"]
+    # Everything due right now goes in one request; otherwise just the selection
+    batch = current_due or [current_selection]
     try:
-        r = requests.post(f"{FLASK_SERVER}/update_medicine_status",
-                          json={"patient_id": pid, "status": "given"},
-                          timeout=6)
-        data = r.json()
-        if data.get("success"):
-            status_label.config(text=f"Patient {pid} marked as GIVEN ✅")
+        results = confirm_given_many(batch)
+        given = [d["patient_id"] for d, r in zip(batch, results) if r.get("success")]
+        failed = [(d["patient_id"], r.get("message", "Unknown error"))
+                  for d, r in zip(batch, results) if not r.get("success")]
+        if len(results) < len(batch):
+            failed += [(d["patient_id"], "No response") for d in batch[len(results):]]
+        if not failed:
+            noun = "Patient" if len(given) == 1 else "Patients"
+            status_label.config(text=f"{noun} {', '.join(given)} marked as GIVEN ✅")
+        elif not given:
+            status_label.config(text=f"Update failed: {failed[0][1]}")
         else:
-            status_label.config(text=f"Update failed: {data.get('message','Unknown error')}")
+            status_label.config(text=f"Given: {', '.join(given)}; failed: "
+                                     + ", ".join(f"{pid} ({msg})" for pid, msg in failed))
     except Exception as e:
         status_label.config(text=f"Network error: {e}")
 
@@ -0,0 +1,221 @@
+# backend/dose_instances.py
+# ==============================
+# Materialized dose instances
+# ==============================
+#
+# The patient model only knows "current slot + status" and a daily list of
+# clock times, and history only records a date plus dose_time. This table
+# expands each schedule into concrete doses — (patient, scheduled datetime,
+# state) — for a rolling horizon, so "was the 10:00 PM dose on the 9th
+# given?" is one dictionary lookup, and every give/miss/revert updates
+# exactly one row. A time-ordered index over all rows answers ward-wide
+# "what is scheduled between A and B" with two bisects; ranges past the
+# generated horizon are expanded when they are first asked for.
+
+import bisect
+import threading
+from datetime import datetime, timedelta
+
+from backend.schedule import parse_minutes
+
+# Row states mirror the history statuses
+PENDING, GIVEN, MISSED = "Due", "Given", "Missed"
+STATES = (PENDING, GIVEN, MISSED)
+
+
+class DoseInstance:
+    __slots__ = ("patient_id", "scheduled_at", "dose_time", "state", "updated")
+
+    def __init__(self, patient_id, scheduled_at, dose_time, state=PENDING):
+        self.patient_id = patient_id
+        self.scheduled_at = scheduled_at
+        self.dose_time = dose_time
+        self.state = state
+        self.updated = None
+
+    def to_dict(self):
+        return {
+            "patient_id": self.patient_id,
+            "date": self.scheduled_at.strftime("%Y-%m-%d"),
+            "dose_time": self.dose_time,
+            "scheduled_at": self.scheduled_at.isoformat(),
+            "state": self.state,
+            "updated": self.updated,
+        }
+
+
+class DoseInstanceTable:
+    def __init__(self, tz, horizon_days=2, max_horizon_days=31):
+        self.tz = tz
+        self.horizon_days = horizon_days
+        self.max_horizon_days = max_horizon_days   # furthest on-demand expansion
+        self._lock = threading.RLock()
+        self._rows = {}          # (patient_id, scheduled_at) -> DoseInstance
+        self._by_patient = {}    # patient_id -> sorted [scheduled_at]
+        self._by_time = []       # sorted [(scheduled_at, patient_id)] over all rows
+        self._generated = {}     # patient_id -> last date expanded
+        self._schedules = {}     # patient_id -> CompiledSchedule last expanded
+        self._today = None       # date of the latest ensure()
+
+    # --------------------------- GENERATION ------------------------
+
+    def at(self, date, dose_time):
+        """
+        Aware datetime for a "YYYY-MM-DD" date and a clock label.
+        """
+        day = datetime.strptime(date, "%Y-%m-%d")
+        return self.tz.localize(day) + timedelta(minutes=parse_minutes(dose_time))
+
+    def ensure(self, patient_id, schedule, today):
+        """
+        Expands `schedule` (a CompiledSchedule) through today + horizon.
+        Only days not generated yet are added, so repeat calls are cheap.
+        """
+        with self._lock:
+            self._schedules[patient_id] = schedule
+            if self._today is None or today > self._today:
+                self._today = today
+            self._expand(patient_id, schedule, today, today + timedelta(days=self.horizon_days))
+
+    def _expand(self, patient_id, schedule, today, last):
+        start = self._generated.get(patient_id)
+        day = today if start is None else start + timedelta(days=1)
+        while day <= last:
+            midnight = self.tz.localize(datetime.combine(day, datetime.min.time()))
+            for m, label in zip(schedule.minutes, schedule.labels):
+                self._insert(patient_id, midnight + timedelta(minutes=m), label)
+            day += timedelta(days=1)
+        if start is None or last > start:
+            self._generated[patient_id] = last
+
+    def regenerate(self, patient_id, schedule, now):
+        """
+        After a schedule edit: drop this patient's still-pending future
+        doses and expand the new schedule in their place.
+        """
+        with self._lock:
+            times = self._by_patient.get(patient_id, [])
+            for at in times[bisect.bisect_right(times, now):]:
+                if self._rows[(patient_id, at)].state == PENDING:
+                    self._remove((patient_id, at))
+            self._generated.pop(patient_id, None)
+
+            today = now.date()
+            midnight = self.tz.localize(datetime.combine(today, datetime.min.time()))
+            for m, label in zip(schedule.minutes, schedule.labels):
+                at = midnight + timedelta(minutes=m)
+                if at > now:
+                    self._insert(patient_id, at, label)
+            self._generated[patient_id] = today
+            self.ensure(patient_id, schedule, today)
+
+    def drop_before(self, cutoff_dt):
+        """
+        Forgets doses scheduled before cutoff_dt (they live on in history).
+        """
+        with self._lock:
+            for pid, times in self._by_patient.items():
+                cut = bisect.bisect_left(times, cutoff_dt)
+                for at in times[:cut]:
+                    self._rows.pop((pid, at), None)
+                del times[:cut]
+            # (cutoff_dt,) sorts before every (cutoff_dt, pid)
+            del self._by_time[:bisect.bisect_left(self._by_time, (cutoff_dt,))]
+
+    # ---------------------------- UPDATES --------------------------
+
+    def set_state(self, patient_id, scheduled_at, dose_time, state, stamp=None):
+        """
+        O(1) update of one dose; creates the row if it wasn't generated
+        (e.g. a dose outside the horizon or from before a schedule edit).
+        """
+        with self._lock:
+            row = self._rows.get((patient_id, scheduled_at))
+            if row is None:
+                row = self._insert(patient_id, scheduled_at, dose_time)
+            row.state = state
+            row.updated = stamp
+            return row
+
+    def record(self, entry):
+        """
+        Applies one history entry (Given / Missed / Due-revert) to its row.
+        """
+        state = entry.get("status")
+        if state not in STATES or not entry.get("dose_time") or not entry.get("time"):
+            return None
+        try:
+            at = self.at(entry["time"], entry["dose_time"])
+        except ValueError:
+            return None
+        return self.set_state(entry.get("patient_id"), at, entry["dose_time"], state,
+                              stamp=entry.get("time"))
+
+    # ----------------------------- READS ---------------------------
+
+    def get(self, patient_id, scheduled_at):
+        return self._rows.get((patient_id, scheduled_at))
+
+    def between(self, start, end, patient_id=None):
+        """
+        Doses scheduled in [start, end), in time order. With a patient_id
+        only that patient's doses are looked at. A range past the generated
+        horizon is expanded first (up to max_horizon_days ahead).
+        """
+        with self._lock:
+            self._extend_to(end, patient_id)
+            if patient_id is not None:
+                return [self._rows[(patient_id, at)]
+                        for at in self._slice(patient_id, start, end)]
+            lo = bisect.bisect_left(self._by_time, (start,))
+            hi = bisect.bisect_left(self._by_time, (end,))
+            return [self._rows[(pid, at)] for at, pid in self._by_time[lo:hi]]
+
+    def __len__(self):
+        return len(self._rows)
+
+    # ---------------------------- INTERNAL -------------------------
+
+    def _extend_to(self, end, patient_id=None):
+        if self._today is None:
+            return
+        last = min((end - timedelta(microseconds=1)).date(),
+                   self._today + timedelta(days=self.max_horizon_days))
+        pids = [patient_id] if patient_id is not None else list(self._schedules)
+        for pid in pids:
+            schedule = self._schedules.get(pid)
+            if schedule is not None and self._generated.get(pid, last) < last:
+                self._expand(pid, schedule, self._today, last)
+
+    def _insert(self, patient_id, scheduled_at, dose_time):
+        key = (patient_id, scheduled_at)
+        row = self._rows.get(key)
+        if row is None:
+            row = self._rows[key] = DoseInstance(patient_id, scheduled_at, dose_time)
+            # Generation runs forward in time, so these are nearly always appends
+            _insort(self._by_patient.setdefault(patient_id, []), scheduled_at)
+            _insort(self._by_time, (scheduled_at, patient_id))
+        return row
+
+    def _remove(self, key):
+        self._rows.pop(key, None)
+        pid, at = key
+        _discard(self._by_patient.get(pid, []), at)
+        _discard(self._by_time, (at, pid))
+
+    def _slice(self, patient_id, start, end):
+        times = self._by_patient.get(patient_id, [])
+        return times[bisect.bisect_left(times, start):bisect.bisect_left(times, end)]
+
+
+def _insort(items, value):
+    if not items or items[-1] < value:
+        items.append(value)
+    else:
+        bisect.insort(items, value)
+
+
+def _discard(items, value):
+    i = bisect.bisect_left(items, value)
+    if i < len(items) and items[i] == value:
+        del items[i]
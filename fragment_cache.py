@@ -0,0 +1,58 @@
+# backend/fragment_cache.py
+# ==============================
+# Rendered page cache
+# ==============================
+#
+# Profile and patient-list pages are rendered from data that rarely changes
+# (education, experience, vitals...). Rendered HTML is kept here under a key
+# that includes the version of every entity the page shows, so a change to
+# any of them makes a new key and the old page simply ages out of the LRU.
+
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()     # key -> rendered text, least recent first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_render(self, key, render):
+        """
+        Cached text for `key`, or render() stored under it.
+        """
+        with self._lock:
+            text = self._pages.get(key)
+            if text is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return text
+            self.misses += 1
+
+        # Render outside the lock; a concurrent miss just renders twice
+        text = render()
+        with self._lock:
+            self._pages[key] = text
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+                self.evictions += 1
+        return text
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._pages),
+                "bytes": sum(len(text) for text in self._pages.values()),
+            }
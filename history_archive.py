@@ -0,0 +1,145 @@
+# backend/history_archive.py
+# ==============================
+# Day-partitioned history archive
+# ==============================
+#
+# Only the last HISTORY_HOT_DAYS of history stay in the live store and in
+# memory. Older events are moved here, one gzip-compressed JSONL file per
+# day (history_archive/2025-12-10.jsonl.gz), and are read back on demand
+# when someone asks for that date range.
+
+import gzip
+import json
+import os
+import re
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+DAY_FILE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.jsonl\.gz$")
+
+
+class HistoryArchive:
+    def __init__(self, directory, compresslevel=6, blocking=None):
+        self.directory = directory
+        self.compresslevel = compresslevel
+        self.blocking = blocking        # blocking(fn, *args), e.g. run_blocking
+        os.makedirs(directory, exist_ok=True)
+        self._days = None           # sorted day list, valid while the dir mtime holds
+        self._days_mtime = None
+
+    def path_for(self, day):
+        return os.path.join(self.directory, f"{day}.jsonl.gz")
+
+    def days(self, date_from=None, date_to=None):
+        """
+        Archived dates ("YYYY-MM-DD"), oldest first, limited to the range.
+        The directory is listed again only after it changed (archival here
+        or in another worker), otherwise this is one stat().
+        """
+        mtime = os.stat(self.directory).st_mtime_ns
+        if self._days is None or mtime != self._days_mtime:
+            days = []
+            for name in os.listdir(self.directory):
+                m = DAY_FILE.match(name)
+                if m:
+                    days.append(m.group(1))
+            days.sort()
+            self._days, self._days_mtime = days, mtime
+        days = self._days
+        lo = bisect_left(days, date_from) if date_from else 0
+        hi = bisect_right(days, date_to) if date_to else len(days)
+        return days[lo:hi]
+
+    # ---------------------------- WRITE ----------------------------
+
+    def add(self, entries):
+        """
+        Files entries under their "YYYY-MM-DD" date. Each touched day is
+        rewritten as a whole (temp file + rename), so a partition is never
+        half-written. Entries have no id of their own, so an entry already
+        in the partition is only added again if this batch holds more
+        copies of it (a dose given, reverted and given again) — re-archiving
+        the same rows after a crash or a repeated import adds nothing.
+        Returns the number of entries added.
+        """
+        by_day = {}
+        for entry in entries:
+            by_day.setdefault(entry["time"], []).append(entry)
+
+        added = 0
+        for day, items in by_day.items():
+            path = self.path_for(day)
+            existing = list(self.read_day(day)) if os.path.exists(path) else []
+            have = Counter(_key(e) for e in existing)
+            new = []
+            for entry in items:
+                key = _key(entry)
+                if have[key]:
+                    have[key] -= 1
+                else:
+                    new.append(entry)
+            if not new:
+                continue
+            added += len(new)
+            tmp_path = path + ".tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8",
+                           compresslevel=self.compresslevel) as f:
+                for entry in existing + new:
+                    f.write(json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n")
+            os.replace(tmp_path, path)
+        if added:
+            self._days = None
+        return added
+
+    # ----------------------------- READ ----------------------------
+
+    def read_day(self, day):
+        path = self.path_for(day)
+        if not os.path.exists(path):
+            return
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    def load_day(self, day):
+        """
+        One day's entries as a list, decompressed off the event loop when
+        a `blocking` runner is set.
+        """
+        if self.blocking is not None:
+            return self.blocking(lambda: list(self.read_day(day)))
+        return list(self.read_day(day))
+
+    def query(self, patient_ids=None, status=None, date_from=None, date_to=None):
+        """
+        Streams archived entries, oldest day first, one partition at a time.
+        """
+        if patient_ids is not None:
+            patient_ids = set(patient_ids)
+        for day in self.days(date_from, date_to):
+            for entry in self.load_day(day):
+                if patient_ids is not None and entry.get("patient_id") not in patient_ids:
+                    continue
+                if status is not None and entry.get("status") != status:
+                    continue
+                yield entry
+
+
+def _key(entry):
+    return json.dumps(entry, sort_keys=True)
+
+
+def archive_store(store, archive, cutoff):
+    """
+    Moves every entry dated before `cutoff` from the live store into the
+    archive. The archive is written first, so a crash in between can only
+    leave a day in both places, never in neither.
+    """
+    cold = list(store.entries_before(cutoff))
+    if not cold:
+        return 0
+    archive.add(cold)
+    store.drop_before(cutoff)
+    return len(cold)
@@ -0,0 +1,129 @@
+# backend/history_cache.py
+# ==============================
+# Cached history read layer
+# ==============================
+#
+# History pages used to re-read and re-parse the whole history file on
+# every view. This keeps the persisted history in memory and only goes
+# back to disk when the store's signature (file mtime/size) changes — and
+# then only reads what was appended since the last look.
+#
+# Entries are handed out as read-only mappings; callers that need to add
+# fields must copy them first. Each entry is also JSON-encoded once, when it
+# is first read, so history responses are built by joining those fragments
+# instead of re-encoding unchanged entries on every view.
+
+import heapq
+import json
+import threading
+from types import MappingProxyType
+
+
+class HistoryCache:
+    def __init__(self, store, names=None, blocking=None):
+        self.store = store
+        self.names = names           # names(patient_id) -> display name, for old entries
+        self.blocking = blocking     # blocking(fn, *args), e.g. run_blocking
+        self._lock = threading.Lock()
+        self._signature = object()   # never equal to a real signature
+        self._token = None
+        self._by_patient = {}        # pid -> [(id, read-only entry), ...] oldest first
+        self._fragments = {}         # id -> (read-only entry, JSON text of it)
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    # ---------------------------- REFRESH --------------------------
+
+    def _refresh(self):
+        signature = self._call(self.store.signature)
+        with self._lock:
+            if signature == self._signature:
+                self.hits += 1
+                return
+            self.misses += 1
+
+            rows, token, reset = self._call(self.store.changes_since, self._token)
+            if reset:
+                self.reloads += 1
+                self._by_patient = {}
+                self._fragments = {}
+            for row_id, entry in rows:
+                view = MappingProxyType(entry)
+                self._by_patient.setdefault(entry.get("patient_id"), []).append((row_id, view))
+                self._fragments[row_id] = (view, self.encode(entry))
+
+            self._token = token
+            self._signature = signature
+
+    def _call(self, fn, *args):
+        # Store reads go to a native thread under an async server
+        if self.blocking is not None:
+            return self.blocking(fn, *args)
+        return fn(*args)
+
+    # ----------------------------- READ ----------------------------
+
+    def query_desc(self, patient_ids=None, status=None, date_from=None, date_to=None,
+                   before_id=None):
+        """
+        Same contract as the stores' query_desc(), served from memory.
+        """
+        self._refresh()
+        with self._lock:
+            if patient_ids is None:
+                lists = list(self._by_patient.values())
+            else:
+                lists = [self._by_patient[pid] for pid in patient_ids if pid in self._by_patient]
+            # Snapshot the lists so concurrent refreshes can't shift them
+            lists = [rows[:] for rows in lists]
+
+        newest_first = heapq.merge(*(reversed(rows) for rows in lists),
+                                   key=lambda row: row[0], reverse=True)
+        for row_id, entry in newest_first:
+            if before_id is not None and row_id >= before_id:
+                continue
+            date = entry.get("time") or ""
+            if status is not None and entry.get("status") != status:
+                continue
+            if date_from is not None and date < date_from:
+                continue
+            if date_to is not None and date > date_to:
+                continue
+            yield row_id, entry
+
+    # ----------------------------- JSON ----------------------------
+
+    def encode(self, entry):
+        """
+        JSON text of one entry, with patient_name filled in if missing.
+        """
+        if not entry.get("patient_name") and self.names is not None:
+            name = self.names(entry.get("patient_id"))
+            if name:
+                entry = dict(entry, patient_name=name)
+        return json.dumps(dict(entry))
+
+    def fragment(self, cursor, entry):
+        """
+        Pre-encoded JSON for a row page_history_json() paged; rows that
+        didn't come from the live store (archived days) are encoded now.
+        Row ids are reused after a rewrite or archival, so the cached text
+        is only used if it was made from this very entry object.
+        """
+        if isinstance(cursor, str) and cursor.isdigit():
+            cached = self._fragments.get(int(cursor))
+            if cached is not None and cached[0] is entry:
+                return cached[1]
+        return self.encode(entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "patients": len(self._by_patient),
+                "entries": sum(len(rows) for rows in self._by_patient.values()),
+                "fragment_bytes": sum(len(text) for _, text in self._fragments.values()),
+            }
@@ -0,0 +1,241 @@
+# backend/history_db.py
+# ==============================
+# SQLite dose history store
+# ==============================
+#
+# Drop-in alternative to HistoryJournal (same append/load/query methods)
+# for when months of history have to stay online. Runs in WAL mode so
+# readers never block the writer, and the indexes below turn per-patient,
+# per-dose and date-range lookups into B-tree searches instead of scans.
+
+import os
+import sqlite3
+import threading
+
+from backend.history_journal import read_legacy_json
+
+COLUMNS = ("patient_id", "patient_name", "dose_time", "time", "action", "status")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id   TEXT NOT NULL,
+    patient_name TEXT,
+    dose_time    TEXT,
+    date         TEXT NOT NULL,
+    action       TEXT,
+    status       TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_history_patient_date
+    ON history (patient_id, date);
+CREATE INDEX IF NOT EXISTS idx_history_patient_dose_status
+    ON history (patient_id, dose_time, status);
+CREATE INDEX IF NOT EXISTS idx_history_status
+    ON history (status);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('migrated', 0);
+"""
+
+DATE_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]"
+
+
+class SQLiteHistoryStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()          # guards the single writer connection
+        self._local = threading.local()        # one reader connection per thread
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    # ---------------------------- WRITE ----------------------------
+
+    def append(self, entry):
+        self.append_many([entry])
+
+    def append_many(self, entries):
+        """
+        Inserts a batch of history entries in a single transaction.
+        """
+        if not entries:
+            return
+        with self._lock, self._conn:
+            self._insert(entries)
+
+    def _insert(self, entries):
+        self._conn.executemany(
+            "INSERT INTO history (patient_id, patient_name, dose_time, date, action, status) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [tuple(e.get(c) for c in COLUMNS) for e in entries],
+        )
+
+    # ----------------------------- READ ----------------------------
+
+    def iter_entries(self):
+        return self.query()
+
+    def load(self):
+        """
+        Returns {patient_id: [entries...]} in insertion order.
+        """
+        history = {}
+        for entry in self.iter_entries():
+            history.setdefault(entry["patient_id"], []).append(entry)
+        return history
+
+    def query(self, patient_ids=None, status=None, date_from=None, date_to=None,
+              dose_time=None):
+        """
+        Yields entries matching every given filter, oldest first.
+        Dates are the "YYYY-MM-DD" strings stored in each entry's "time".
+        """
+        for _, entry in self._select(patient_ids, status, date_from, date_to,
+                                     dose_time, None, "ORDER BY id"):
+            yield entry
+
+    def query_desc(self, patient_ids=None, status=None, date_from=None, date_to=None,
+                   before_id=None):
+        """
+        Yields (id, entry) newest first, only ids below before_id — keyset
+        paging, so page N costs the same as page 1.
+        """
+        return self._select(patient_ids, status, date_from, date_to,
+                            None, before_id, "ORDER BY id DESC")
+
+    def _select(self, patient_ids, status, date_from, date_to, dose_time, before_id, order,
+                before_date=None):
+        where, params = [], []
+        if patient_ids is not None:
+            patient_ids = list(patient_ids)
+            if not patient_ids:
+                return
+            where.append("patient_id IN (%s)" % ",".join("?" * len(patient_ids)))
+            params.extend(patient_ids)
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+        if dose_time is not None:
+            where.append("dose_time = ?")
+            params.append(dose_time)
+        if date_from is not None:
+            where.append("date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            where.append("date <= ?")
+            params.append(date_to)
+        if before_id is not None:
+            where.append("id < ?")
+            params.append(before_id)
+        if before_date is not None:
+            where.append(f"date < ? AND date GLOB '{DATE_GLOB}'")
+            params.append(before_date)
+
+        sql = "SELECT id, patient_id, patient_name, dose_time, date, action, status FROM history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " " + order
+
+        # Rows are streamed straight off the cursor, so large date ranges
+        # never have to fit in memory at once.
+        for row in self._reader().execute(sql, params):
+            yield row[0], dict(zip(COLUMNS, row[1:]))
+
+    def signature(self):
+        """
+        Cheap change detector for readers that cache the history; commits
+        land in the -wal file first, so both files are checked.
+        """
+        sig = []
+        for path in (self.path, self.path + "-wal"):
+            try:
+                st = os.stat(path)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append(None)
+        return tuple(sig)
+
+    def changes_since(self, token):
+        """
+        Returns (rows, token, reset) like HistoryJournal.changes_since();
+        the token is (generation, highest row id seen). The generation is
+        bumped whenever rows are deleted.
+        """
+        conn = self._reader()
+        generation = conn.execute(
+            "SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+        seen_generation, last_id = token or (generation, 0)
+        reset = seen_generation != generation
+        if reset:
+            last_id = 0
+
+        rows = [
+            (row[0], dict(zip(COLUMNS, row[1:])))
+            for row in conn.execute(
+                "SELECT id, patient_id, patient_name, dose_time, date, action, status "
+                "FROM history WHERE id > ? ORDER BY id", (last_id,))
+        ]
+        if rows:
+            last_id = rows[-1][0]
+        return rows, (generation, last_id), reset
+
+    # --------------------------- ARCHIVAL --------------------------
+
+    def entries_before(self, cutoff):
+        for _, entry in self._select(None, None, None, None, None, None,
+                                     "ORDER BY id", before_date=cutoff):
+            yield entry
+
+    def drop_before(self, cutoff):
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"DELETE FROM history WHERE date < ? AND date GLOB '{DATE_GLOB}'", (cutoff,))
+            # Deleted rows can't be seen through "id > last", so tell
+            # incremental readers to start over
+            self._conn.execute(
+                "UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+
+    def count(self):
+        return self._reader().execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    # --------------------------- MIGRATION -------------------------
+
+    def import_entries(self, entries):
+        """
+        One-shot import; returns the number of records imported. The
+        database remembers that it was migrated, so a table emptied by
+        archival is not filled again from the old source on restart.
+        """
+        if self.migrated():
+            return 0
+        # A database with history from before the flag existed was migrated too
+        entries = [] if self.count() else list(entries)
+        with self._lock, self._conn:
+            self._insert(entries)
+            self._conn.execute("UPDATE meta SET value = 1 WHERE key = 'migrated'")
+        return len(entries)
+
+    def migrate_from_json(self, json_path):
+        if self.migrated() or not os.path.exists(json_path):
+            return 0
+        return self.import_entries(read_legacy_json(json_path))
+
+    def migrated(self):
+        return bool(self._reader().execute(
+            "SELECT value FROM meta WHERE key = 'migrated'").fetchone()[0])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,66 @@
+# backend/history_export.py
+# ==============================
+# Streaming history export
+# ==============================
+#
+# Audit exports can span months and every patient, so nothing here builds
+# the whole result: archived days are decompressed one partition at a
+# time, the live store is read off its cursor, and each row is encoded and
+# handed to the response as soon as it is read.
+
+import csv
+import json
+
+from backend.history_query import matches_search
+
+CSV_HEADER = ["Patient ID", "Patient Name", "Event Time", "Dose Time", "Action", "Status"]
+CSV_FIELDS = ["patient_id", "patient_name", "time", "dose_time", "action", "status"]
+
+
+class _Line:
+    # csv.writer target that hands back the encoded line instead of storing it
+    def write(self, value):
+        return value
+
+
+def iter_history(store, archive, patient_ids=None, status=None, date_from=None,
+                 date_to=None, search=None):
+    """
+    Yields matching entries oldest first: archived days, then the live store.
+    """
+    term = (search or "").strip().lower()
+    sources = []
+    if archive is not None:
+        sources.append(archive.query(patient_ids=patient_ids, status=status,
+                                     date_from=date_from, date_to=date_to))
+    sources.append(store.query(patient_ids=patient_ids, status=status,
+                               date_from=date_from, date_to=date_to))
+
+    for source in sources:
+        for entry in source:
+            if matches_search(entry, term):
+                yield entry
+
+
+def csv_stream(entries, names=None):
+    writer = csv.writer(_Line())
+    yield writer.writerow(CSV_HEADER)
+    for entry in entries:
+        row = [entry.get(f) or "" for f in CSV_FIELDS]
+        if not row[1] and names:
+            row[1] = names.get(entry.get("patient_id"), "")
+        yield writer.writerow(row)
+
+
+def ndjson_stream(entries, names=None):
+    for entry in entries:
+        entry = dict(entry)
+        if not entry.get("patient_name") and names:
+            entry["patient_name"] = names.get(entry.get("patient_id"), "")
+        yield json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n"
+
+
+FORMATS = {
+    "csv": (csv_stream, "text/csv"),
+    "ndjson": (ndjson_stream, "application/x-ndjson"),
+}
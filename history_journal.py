@@ -0,0 +1,235 @@
+# backend/history_journal.py
+# ==============================
+# Append-only dose history journal
+# ==============================
+#
+# One compact JSON record per line. Logging a dose appends a single line
+# instead of rewriting every patient's history, and the in-memory
+# patients[pid]["history"] lists are rebuilt from the journal at startup.
+
+import json
+import os
+import re
+
+DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class HistoryJournal:
+    def __init__(self, path):
+        self.path = path
+
+    # ---------------------------- WRITE ----------------------------
+
+    def append(self, entry):
+        self.append_many([entry])
+
+    def append_many(self, entries):
+        """
+        Appends a batch of history entries with one write and one fsync.
+        """
+        if not entries:
+            return
+        data = "".join(_encode(e) for e in entries)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # ----------------------------- READ ----------------------------
+
+    def iter_entries(self):
+        """
+        Yields every journal record in write order.
+        A torn last line (crash mid-append) is skipped, not fatal.
+        """
+        for _, entry in self._iter_numbered():
+            yield entry
+
+    def _iter_numbered(self):
+        # The line number doubles as a stable record id for paging
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict):
+                    yield lineno, entry
+
+    def load(self):
+        """
+        Returns {patient_id: [entries...]} in write order.
+        """
+        history = {}
+        for entry in self.iter_entries():
+            history.setdefault(entry.get("patient_id"), []).append(entry)
+        return history
+
+    def query(self, patient_ids=None, status=None, date_from=None, date_to=None,
+              dose_time=None):
+        """
+        Same filters as SQLiteHistoryStore.query(). The journal has no
+        index, so this is a linear scan of the file.
+        """
+        if patient_ids is not None:
+            patient_ids = set(patient_ids)
+        for entry in self.iter_entries():
+            if _matches(entry, patient_ids, status, date_from, date_to, dose_time):
+                yield entry
+
+    def signature(self):
+        """
+        Cheap change detector for readers that cache the journal.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def changes_since(self, token):
+        """
+        Returns (rows, token, reset): the (id, entry) rows written after
+        `token`, a token for the next call, and whether the journal was
+        replaced so the caller must drop what it had (rows then start
+        from the beginning).
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return [], None, token is not None
+
+        inode, offset, lineno = token or (st.st_ino, 0, 0)
+        reset = token is not None and (inode != st.st_ino or st.st_size < offset)
+        if reset or token is None:
+            inode, offset, lineno = st.st_ino, 0, 0
+
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+
+        # Only consume complete lines; a half-written tail is read next time
+        end = data.rfind(b"\n") + 1
+        rows = []
+        for line in data[:end].splitlines():
+            lineno += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, dict):
+                rows.append((lineno, entry))
+
+        return rows, (inode, offset + end, lineno), reset
+
+    def query_desc(self, patient_ids=None, status=None, date_from=None, date_to=None,
+                   before_id=None):
+        """
+        Yields (id, entry) newest first, only ids below before_id.
+        """
+        if patient_ids is not None:
+            patient_ids = set(patient_ids)
+        matches = [
+            (lineno, entry) for lineno, entry in self._iter_numbered()
+            if (before_id is None or lineno < before_id)
+            and _matches(entry, patient_ids, status, date_from, date_to, None)
+        ]
+        return reversed(matches)
+
+    # --------------------------- ARCHIVAL --------------------------
+
+    def entries_before(self, cutoff):
+        for entry in self.iter_entries():
+            if is_before(entry, cutoff):
+                yield entry
+
+    def drop_before(self, cutoff):
+        """
+        Rewrites the journal without entries dated before `cutoff`.
+        Must not race with append_many() — run it on the writer thread.
+        """
+        keep = [e for e in self.iter_entries() if not is_before(e, cutoff)]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(_encode(e) for e in keep))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    # --------------------------- MIGRATION -------------------------
+
+    def migrate_from_json(self, json_path):
+        """
+        One-shot import of the old {pid: [entries]} history_store.json.
+        Only runs while the journal does not exist yet and the legacy file
+        hasn't been imported before; returns the number of records imported.
+        """
+        done_path = json_path + ".migrated"
+        if os.path.exists(self.path) or os.path.exists(done_path) or not os.path.exists(json_path):
+            return 0
+
+        entries = read_legacy_json(json_path)
+
+        # Write to a temp file first so a crash never leaves half a journal
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(_encode(e) for e in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        # Marker that outlives the journal, so a lost or emptied journal
+        # isn't refilled with history that has since been archived
+        with open(done_path, "w", encoding="utf-8") as f:
+            f.write(self.path + "\n")
+        return len(entries)
+
+
+def read_legacy_json(json_path):
+    """
+    Flattens the old {pid: [entries]} history_store.json into a list.
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        saved = json.load(f)
+
+    entries = []
+    for pid, items in (saved or {}).items():
+        if not isinstance(items, list):
+            continue
+        for entry in items:
+            if isinstance(entry, dict):
+                entry.setdefault("patient_id", pid)
+                entries.append(entry)
+    return entries
+
+
+def is_before(entry, cutoff):
+    date = entry.get("time") or ""
+    return bool(DATE.match(date)) and date < cutoff
+
+
+def _matches(entry, patient_ids, status, date_from, date_to, dose_time):
+    date = entry.get("time") or ""
+    if patient_ids is not None and entry.get("patient_id") not in patient_ids:
+        return False
+    if status is not None and entry.get("status") != status:
+        return False
+    if dose_time is not None and entry.get("dose_time") != dose_time:
+        return False
+    if date_from is not None and date < date_from:
+        return False
+    if date_to is not None and date > date_to:
+        return False
+    return True
+
+
+def _encode(entry):
+    return json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n"
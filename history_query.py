@@ -0,0 +1,131 @@
+# backend/history_query.py
+# ==============================
+# Paged history queries
+# ==============================
+#
+# Backs /api/history: patient/status/date filters are pushed down to the
+# history store, free-text search is applied on top, and results come back
+# newest first one page at a time with an opaque cursor for the next page.
+# Once the live store runs out, paging continues into archived days, at
+# most MAX_ARCHIVE_DAYS partitions per request; a sparse filter that hasn't
+# filled the page by then gets a short page and a cursor to resume from.
+
+import re
+from bisect import bisect_right
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+MAX_ARCHIVE_DAYS = 31       # archived partitions decompressed per page request
+
+SEARCH_FIELDS = ("patient_id", "patient_name", "action", "status", "time", "dose_time")
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+ARCHIVE_CURSOR = re.compile(r"^a(\d{4}-\d{2}-\d{2})\.(\d+)$")
+
+
+def parse_cursor(value):
+    """
+    "123" points into the live store (row id), "a2025-12-10.7" into an
+    archived day (position within that day's partition).
+    """
+    if value and ARCHIVE_CURSOR.match(value):
+        return value
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor > 0 else None
+
+
+def matches_search(entry, term):
+    if not term:
+        return True
+    blob = " ".join(str(entry.get(f) or "") for f in SEARCH_FIELDS).lower()
+    return term in blob
+
+
+def page_history_json(cache, patient_ids, status=None, date_from=None, date_to=None,
+                      search=None, cursor=None, limit=DEFAULT_LIMIT, archive=None):
+    """
+    One page from a HistoryCache as (JSON array text, next_cursor), joined
+    from the cache's pre-encoded entries. next_cursor is None on the last
+    page; a page can come back short (even empty) with a cursor when the
+    archive scan budget ran out first.
+    """
+    page, next_cursor = _page(cache, patient_ids, status, date_from, date_to,
+                              search, cursor, limit, archive)
+    return "[" + ", ".join(cache.fragment(c, entry) for c, entry in page) + "]", next_cursor
+
+
+def _page(store, patient_ids, status, date_from, date_to, search, cursor, limit, archive):
+    term = (search or "").strip().lower()
+    rows = _rows_desc(store, archive, patient_ids, status or None,
+                      date_from or None, date_to or None, cursor)
+
+    page = []
+    for row_cursor, entry in rows:
+        if entry is None:          # archive budget spent, resume from here
+            return page, row_cursor
+        if not matches_search(entry, term):
+            continue
+        page.append((row_cursor, entry))
+        if len(page) > limit:      # one extra row tells us there is a next page
+            break
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = page[-1][0]
+
+    return page, next_cursor
+
+
+def _rows_desc(store, archive, patient_ids, status, date_from, date_to, cursor):
+    # Yields (cursor, entry) newest first: live store, then archived days.
+    # After MAX_ARCHIVE_DAYS partitions it yields (resume cursor, None).
+    archive_day, archive_pos = None, None
+    if isinstance(cursor, str):
+        m = ARCHIVE_CURSOR.match(cursor)
+        archive_day, archive_pos = m.group(1), int(m.group(2))
+    else:
+        for row_id, entry in store.query_desc(
+                patient_ids=patient_ids, status=status,
+                date_from=date_from, date_to=date_to, before_id=cursor):
+            yield str(row_id), entry
+
+    if archive is None:
+        return
+
+    if patient_ids is not None:
+        patient_ids = set(patient_ids)
+    days = archive.days(date_from, date_to)
+    if archive_day is not None:
+        days = days[:bisect_right(days, archive_day)]
+    scanned = 0
+    for day in reversed(days):
+        if day == archive_day and archive_pos == 0:
+            continue               # nothing left before position 0
+        if scanned == MAX_ARCHIVE_DAYS:
+            # "a<day>.0" is past everything in the last day read
+            yield f"a{last_day}.0", None
+            return
+        scanned += 1
+        last_day = day
+        entries = archive.load_day(day)          # one partition at a time
+        for pos in range(len(entries) - 1, -1, -1):
+            if day == archive_day and pos >= archive_pos:
+                continue
+            entry = entries[pos]
+            if patient_ids is not None and entry.get("patient_id") not in patient_ids:
+                continue
+            if status is not None and entry.get("status") != status:
+                continue
+            yield f"a{day}.{pos}", entry
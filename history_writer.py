@@ -0,0 +1,190 @@
+# backend/history_writer.py
+# ==============================
+# Group-commit history writer
+# ==============================
+#
+# Request threads hand history entries to a bounded queue and return
+# immediately. One writer thread drains the queue and persists everything
+# that arrived within a flush interval as a single batch (one journal
+# append + fsync, or one sqlite transaction), so many nurses clicking at
+# once cost one disk write instead of racing each other. Under an async
+# server the write itself can be handed to a native thread via `blocking`.
+#
+# A failed write keeps its batch and is retried with exponential backoff.
+# While the store is failing, flush() reports False instead of pretending
+# the data is on disk, queued maintenance tasks wait for the next good
+# write, and once `max_pending` entries are held back the writer stops
+# draining the queue so submit() blocks callers rather than eating memory.
+
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class _Flush:
+    def __init__(self):
+        self.event = threading.Event()
+        self.ok = False
+
+    def release(self, ok):
+        self.ok = ok
+        self.event.set()
+
+
+class HistoryWriter:
+    def __init__(self, store, flush_interval=0.5, flush_size=200, queue_size=10000,
+                 blocking=None, max_pending=None, retry_delay=0.5, max_retry_delay=30.0):
+        self.store = store
+        self.blocking = blocking        # blocking(fn, *args), e.g. run_blocking
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.max_pending = max_pending or queue_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.last_error = None          # set while the store keeps failing
+        self._thread = None
+        self.batches_written = 0
+        self.entries_written = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="history-writer")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    # -------------------------- PRODUCERS --------------------------
+
+    def submit(self, entry):
+        """
+        Queues one entry. Blocks only when the queue is full, which pushes
+        back on callers instead of growing memory without bound.
+        """
+        self._queue.put(entry)
+
+    def submit_many(self, entries):
+        """
+        Queues a list of entries that must land in the same batch.
+        """
+        if entries:
+            self._queue.put(list(entries))
+
+    def submit_task(self, fn):
+        """
+        Runs fn() on the writer thread, after everything queued before it
+        is written — for maintenance that must not race with appends.
+        """
+        self._queue.put(fn)
+
+    def flush(self, timeout=None):
+        """
+        Waits until everything submitted before this call is on disk.
+        Returns True if it is, False if the write failed or timed out.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return self.last_error is None
+        if self.last_error is not None:
+            return False
+        done = _Flush()
+        self._queue.put(done)
+        return done.event.wait(timeout) and done.ok
+
+    def close(self, timeout=5):
+        """
+        Writes out whatever is still queued and stops the thread.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    # ---------------------------- WRITER ---------------------------
+
+    def _run(self):
+        pending = []
+        deferred = []       # tasks held back while writes are failing
+        delay = self.retry_delay
+        retry_at = 0.0      # no write attempts before this while failing
+        while True:
+            waiters = []
+            tasks = []
+            stop = False
+
+            if len(pending) >= self.max_pending:
+                # Store is down and the backlog is full: leave the queue alone
+                # (producers block in submit) until the next retry is due
+                time.sleep(max(0.0, retry_at - time.monotonic()))
+            else:
+                if pending:
+                    item = self._get(max(0.0, retry_at - time.monotonic()))
+                else:
+                    item = self._queue.get()
+                deadline = time.monotonic() + self.flush_interval
+
+                # Collect everything that arrives before the deadline/size limit
+                while item is not None:
+                    if item is _STOP:
+                        stop = True
+                    elif isinstance(item, _Flush):
+                        waiters.append(item)
+                    elif isinstance(item, list):
+                        pending.extend(item)
+                    elif callable(item):
+                        tasks.append(item)
+                    else:
+                        pending.append(item)
+
+                    # A flush(), task or shutdown means "write now", don't keep waiting
+                    if stop or waiters or tasks or len(pending) >= self.flush_size:
+                        break
+                    item = self._get(deadline - time.monotonic())
+
+            if pending and (stop or time.monotonic() >= retry_at):
+                try:
+                    if self.blocking is not None:
+                        self.blocking(self.store.append_many, pending)
+                    else:
+                        self.store.append_many(pending)
+                    self.batches_written += 1
+                    self.entries_written += len(pending)
+                    pending = []
+                    self.last_error = None
+                    delay = self.retry_delay
+                except Exception as e:
+                    # Keep the batch and retry it after a growing pause
+                    print("ERROR in history writer:", e)
+                    self.last_error = e
+                    retry_at = time.monotonic() + delay
+                    delay = min(delay * 2, self.max_retry_delay)
+
+            ok = self.last_error is None
+            for w in waiters:
+                w.release(ok)
+
+            # Maintenance (archival) must not run over entries that are not
+            # on disk yet, so it waits until the store accepts writes again
+            deferred.extend(tasks)
+            if ok:
+                for task in deferred:
+                    try:
+                        task()
+                    except Exception as e:
+                        print("ERROR in history writer task:", e)
+                deferred = []
+
+            if stop:
+                if pending:
+                    print("ERROR in history writer: %d entries not written" % len(pending))
+                return
+
+    def _get(self, timeout):
+        if timeout <= 0:
+            return None
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
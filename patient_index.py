@@ -0,0 +1,113 @@
+# backend/patient_index.py
+# ==============================
+# Patient reverse indexes
+# ==============================
+#
+# Role-scoped views need "patients of this doctor / nurse / room". Patients
+# only name their doctor by display name and nurses carry an
+# assigned_patients list, so answering that meant scanning every patient.
+# PatientIndex keeps doctor_id -> patients, nurse_id -> patients and
+# room -> patients, built once at load time and kept up to date by
+# admit(), discharge() and reassign(), so each lookup is O(k).
+
+import threading
+
+
+class PatientIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> {patient_id: None}; dicts keep admission order
+        self._by_doctor = {}
+        self._by_nurse = {}
+        self._by_room = {}
+        self._staff = {}     # patient_id -> (doctor_id, room, (nurse_ids...))
+
+    def build(self, patients, doctors, nurses):
+        """
+        Indexes the loaded data: patients name their doctor by display name,
+        nurses list their assigned patient IDs.
+        """
+        doctor_ids_by_name = {d["name"]: did for did, d in doctors.items()}
+        nurse_ids = {}
+        for nid, n in nurses.items():
+            assigned = n.get("assigned_patients", [])
+            if isinstance(assigned, str):
+                assigned = [assigned]
+            for pid in assigned:
+                nurse_ids.setdefault(pid, []).append(nid)
+
+        with self._lock:
+            self._by_doctor, self._by_nurse, self._by_room, self._staff = {}, {}, {}, {}
+        for pid, p in patients.items():
+            self.admit(pid, doctor_ids_by_name.get(p.get("doctor")),
+                       nurse_ids.get(pid, ()), p.get("room"))
+
+    # ---------------------------- UPDATES --------------------------
+
+    def admit(self, patient_id, doctor_id=None, nurse_ids=(), room=None):
+        with self._lock:
+            self._unlink(patient_id)
+            self._staff[patient_id] = (doctor_id, room, tuple(nurse_ids))
+            if doctor_id:
+                self._by_doctor.setdefault(doctor_id, {})[patient_id] = None
+            if room:
+                self._by_room.setdefault(room, {})[patient_id] = None
+            for nid in nurse_ids:
+                self._by_nurse.setdefault(nid, {})[patient_id] = None
+
+    def discharge(self, patient_id):
+        with self._lock:
+            self._unlink(patient_id)
+            self._staff.pop(patient_id, None)
+
+    def reassign(self, patient_id, **changes):
+        """
+        Moves a patient to another doctor_id, nurse_ids and/or room; fields
+        not given keep their current value.
+        """
+        with self._lock:
+            doctor_id, room, nurse_ids = self._staff.get(patient_id, (None, None, ()))
+        self.admit(
+            patient_id,
+            changes.get("doctor_id", doctor_id),
+            changes.get("nurse_ids", nurse_ids),
+            changes.get("room", room),
+        )
+
+    # ----------------------------- READS ---------------------------
+
+    def doctor_patients(self, doctor_id):
+        with self._lock:
+            return list(self._by_doctor.get(doctor_id, ()))
+
+    def nurse_patients(self, nurse_id):
+        with self._lock:
+            return list(self._by_nurse.get(nurse_id, ()))
+
+    def room_patients(self, room):
+        with self._lock:
+            return list(self._by_room.get(room, ()))
+
+    def staff_for(self, patient_id):
+        """
+        (doctor_id, [nurse_ids]) for a patient.
+        """
+        with self._lock:
+            doctor_id, _, nurse_ids = self._staff.get(patient_id, (None, None, ()))
+        return doctor_id, list(nurse_ids)
+
+    # ---------------------------- INTERNAL -------------------------
+
+    def _unlink(self, patient_id):
+        old = self._staff.get(patient_id)
+        if old is None:
+            return
+        doctor_id, room, nurse_ids = old
+        for index, keys in ((self._by_doctor, [doctor_id]), (self._by_room, [room]),
+                            (self._by_nurse, nurse_ids)):
+            for key in keys:
+                members = index.get(key)
+                if members is not None:
+                    members.pop(patient_id, None)
+                    if not members:
+                        del index[key]
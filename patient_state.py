@@ -0,0 +1,179 @@
+# backend/patient_state.py
+# ==============================
+# Live patient state stores
+# ==============================
+#
+# The fields that change while the app runs — status, current_index and
+# current_date, next_medicine_time, last_updated, the medication schedule
+# and the version — live behind a small store interface:
+#
+#   load_all()                      -> {patient_id: fields}
+#   load(pid)                       -> fields or None
+#   save(pid, fields, expected)     -> bool  (compare-and-set on "version")
+#   save_many([(pid, fields, expected)]) -> [bool]  (one transaction)
+#   changes_since(token)            -> ({patient_id: fields}, token)
+#
+# InProcessStateStore is the default and keeps today's single-process
+# behaviour (the patients dict *is* the state). SQLiteStateStore puts the
+# fields in a WAL database that several worker processes share: every
+# write is a CAS on the version, and each worker pulls other workers'
+# changes with changes_since() before it serves a request.
+
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+
+LIVE_FIELDS = ("status", "current_index", "current_date", "next_medicine_time",
+               "last_updated", "medication_schedule", "version")
+
+
+def live_state(patient):
+    return {f: patient.get(f) for f in LIVE_FIELDS}
+
+
+class InProcessStateStore:
+    shared = False
+
+    def load_all(self):
+        return {}
+
+    def load(self, patient_id):
+        return None
+
+    def save(self, patient_id, fields, expected=None):
+        return True
+
+    def save_many(self, items):
+        return [True] * len(items)
+
+    def changes_since(self, token):
+        return {}, token
+
+
+class SQLiteStateStore:
+    shared = True
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS patient_state (
+        patient_id TEXT PRIMARY KEY,
+        version    INTEGER NOT NULL,
+        seq        INTEGER NOT NULL,
+        fields     TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_patient_state_seq ON patient_state (seq);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def seed(self, patients):
+        """
+        Inserts the initial state of patients this database hasn't seen.
+        Rows other workers already wrote win.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                seq = self._next_seq()
+                for pid, p in patients.items():
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO patient_state (patient_id, version, seq, fields) "
+                        "VALUES (?, ?, ?, ?)",
+                        (pid, p.get("version", 0), seq, json.dumps(live_state(p))),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def load_all(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT patient_id, fields FROM patient_state").fetchall()
+        return {pid: json.loads(fields) for pid, fields in rows}
+
+    def load(self, patient_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fields FROM patient_state WHERE patient_id = ?", (patient_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, patient_id, fields, expected=None):
+        """
+        Writes fields if the stored version is still `expected` (any version
+        when None). Returns False when another worker got there first.
+        """
+        return self.save_many([(patient_id, fields, expected)])[0]
+
+    def save_many(self, items):
+        """
+        save() for several patients in one transaction; returns one bool
+        per item. A conflicting item doesn't stop the others.
+        """
+        results = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                seq = self._next_seq()
+                for patient_id, fields, expected in items:
+                    row = self._conn.execute(
+                        "SELECT version FROM patient_state WHERE patient_id = ?", (patient_id,)
+                    ).fetchone()
+                    if expected is not None and row is not None and row[0] != expected:
+                        results.append(False)
+                        continue
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO patient_state (patient_id, version, seq, fields) "
+                        "VALUES (?, ?, ?, ?)",
+                        (patient_id, fields.get("version", 0), seq, json.dumps(fields)),
+                    )
+                    results.append(True)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return results
+
+    def changes_since(self, token):
+        """
+        Rows written after `token` (a seq; None means everything) and the
+        new token.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT patient_id, seq, fields FROM patient_state WHERE seq > ? ORDER BY seq",
+                (token if token is not None else -1,),
+            ).fetchall()
+        if not rows:
+            return {}, token
+        return {pid: json.loads(fields) for pid, _, fields in rows}, rows[-1][1]
+
+    def _next_seq(self):
+        return self._conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM patient_state").fetchone()[0]
+
+
+def acquire_leader(path):
+    """
+    Non-blocking exclusive lock on `path`. The one worker that gets it runs
+    the timer engines and archival; the returned file must stay open for as
+    long as the worker leads. Returns None if another process holds it.
+    """
+    f = open(path, "a+")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    f.seek(0)
+    f.truncate()
+    f.write(str(os.getpid()))
+    f.flush()
+    return f
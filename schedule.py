@@ -0,0 +1,74 @@
+# backend/schedule.py
+# ==============================
+# Compiled medication schedules
+# ==============================
+#
+# A patient's medication_schedule is a list of clock strings ("08:00 AM").
+# Parsing those with strptime on every request is wasteful, and mixed
+# spellings ("1:08 AM" vs "01:08 AM") don't compare equal. Each schedule is
+# compiled once into sorted minutes-since-midnight plus normalized labels,
+# and all window/lock arithmetic runs on the integers.
+
+from datetime import datetime
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class CompiledSchedule:
+    __slots__ = ("minutes", "labels")
+
+    def __init__(self, minutes, labels):
+        self.minutes = minutes    # tuple of ints, ascending
+        self.labels = labels      # tuple of "HH:MM AM" strings, same order
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def index_of(self, label):
+        """
+        Slot index of a time label (any accepted spelling), or None.
+        """
+        try:
+            m = parse_minutes(label)
+        except ValueError:
+            return None
+        try:
+            return self.minutes.index(m)
+        except ValueError:
+            return None
+
+
+def parse_minutes(label):
+    """
+    "1:08 AM" / "01:08 AM" -> 68. Raises ValueError on anything else.
+    """
+    t = datetime.strptime(str(label).strip().upper(), "%I:%M %p")
+    return t.hour * 60 + t.minute
+
+
+def format_minutes(minutes):
+    """
+    68 -> "01:08 AM" (the canonical label format).
+    """
+    hour, minute = divmod(minutes % MINUTES_PER_DAY, 60)
+    suffix = "AM" if hour < 12 else "PM"
+    return f"{(hour % 12) or 12:02d}:{minute:02d} {suffix}"
+
+
+def compile_schedule(times):
+    """
+    Sorts, de-duplicates and normalizes a list of clock strings.
+    Entries that don't parse are dropped.
+    """
+    minutes = set()
+    for label in times or []:
+        try:
+            minutes.add(parse_minutes(label))
+        except ValueError:
+            continue
+    ordered = tuple(sorted(minutes))
+    return CompiledSchedule(ordered, tuple(format_minutes(m) for m in ordered))
+
+
+def minute_of_day(dt):
+    return dt.hour * 60 + dt.minute
@@ -0,0 +1,38 @@
+# backend/serve_async.py
+# ==============================
+# Production entry point
+# ==============================
+#
+# Runs MediDispense under eventlet (default) or gevent so one process can
+# hold thousands of dashboard websockets:
+#
+#     python -m backend.serve_async                # eventlet on 0.0.0.0:5000
+#     MEDIDISPENSE_ASYNC_MODE=gevent python -m backend.serve_async
+#
+# HOST / PORT override the listen address. The async library must be
+# patched in before anything else imports socket or threading, which is why
+# this is a separate module rather than a flag on app.py.
+
+import os
+import sys
+
+mode = os.environ.setdefault("MEDIDISPENSE_ASYNC_MODE", "eventlet")
+
+if mode == "eventlet":
+    import eventlet
+    eventlet.monkey_patch()
+elif mode == "gevent":
+    from gevent import monkey
+    monkey.patch_all()
+else:
+    sys.exit(f"Unsupported MEDIDISPENSE_ASYNC_MODE: {mode!r} (use eventlet or gevent)")
+
+from backend.app import app, socketio  # noqa: E402  (must follow monkey-patching)
+
+
+if __name__ == "__main__":
+    socketio.run(
+        app,
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "5000")),
+    )
@@ -0,0 +1,103 @@
+# backend/timer_queue.py
+# ==============================
+# Deadline scheduler
+# ==============================
+#
+# A min-heap of (deadline, key) with one thread that sleeps until the
+# earliest deadline, instead of waking every few seconds to compare the
+# clock against every patient. Re-arming a key just pushes a new entry and
+# bumps the key's generation; stale heap entries are skipped when popped.
+# Everything due at the same moment is handed to the callback as one batch.
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class TimerQueue:
+    def __init__(self, on_fire, name="timer-queue"):
+        self.on_fire = on_fire          # on_fire([(key, deadline, payload), ...])
+        self.name = name
+        self._cond = threading.Condition()
+        self._heap = []                 # (deadline, generation, key)
+        self._generation = {}           # key -> (live generation, payload)
+        self._seq = itertools.count()
+        self._thread = None
+        self.fired = 0
+
+    # ---------------------------- ARMING ---------------------------
+
+    def arm(self, key, deadline, payload=None):
+        """
+        (Re)schedules key to fire at `deadline` (epoch seconds). Any
+        earlier arming of the same key is cancelled.
+        """
+        with self._cond:
+            gen = next(self._seq)       # unique, so old heap entries never match again
+            self._generation[key] = (gen, payload)
+            heapq.heappush(self._heap, (deadline, gen, key))
+            # Only wake the thread if this is now the earliest deadline
+            if self._heap[0][1] == gen:
+                self._cond.notify()
+
+    def cancel(self, key):
+        with self._cond:
+            self._generation.pop(key, None)
+
+    def pending(self):
+        with self._cond:
+            return len(self._generation)
+
+    # ---------------------------- RUNNING --------------------------
+
+    def start(self, spawn=None):
+        """
+        Starts the loop on a daemon thread, or via spawn(fn) if given
+        (e.g. socketio.start_background_task).
+        """
+        if self._thread is not None:
+            return self
+        if spawn is not None:
+            self._thread = spawn(self._run)
+        else:
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            due = []
+            with self._cond:
+                while not due:
+                    # Drop cancelled / re-armed entries from the top
+                    while self._heap and self._is_stale(self._heap[0]):
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+
+                    delay = self._heap[0][0] - time.time()
+                    if delay > 0:
+                        self._cond.wait(delay)
+                        continue
+
+                    # Everything due by now fires together, exactly once
+                    now = time.time()
+                    while self._heap and self._heap[0][0] <= now:
+                        deadline, gen, key = heapq.heappop(self._heap)
+                        if self._generation.get(key, (None,))[0] != gen:
+                            continue
+                        payload = self._generation.pop(key)[1]
+                        due.append((key, deadline, payload))
+
+            self.fired += len(due)
+            try:
+                self.on_fire(due)
+            except Exception as e:
+                print(f"ERROR in {self.name}:", e)
+
+    def _is_stale(self, item):
+        _, gen, key = item
+        return self._generation.get(key, (None,))[0] != gen
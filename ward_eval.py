@@ -0,0 +1,213 @@
+# backend/ward_eval.py
+# ==============================
+# Ward-wide dose evaluation
+# ==============================
+#
+# Answers "which doses are due, open or missed right now" for every patient
+# at once. All compiled schedules are packed into one flat array of minutes
+# with per-patient offsets; each patient's position is its current slot and
+# the day that slot belongs to (current_date, relative to today), so slots
+# are compared as absolute minutes. The walk refresh_patient_schedule()
+# makes slot by slot, across days, is computed for the whole ward in a
+# handful of NumPy operations. Without NumPy the pure-Python path gives
+# identical results.
+#
+# Benchmark / self-check:  python -m backend.ward_eval [patients]
+
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
+
+# state codes
+NO_SCHEDULE, DUE, OPEN, DONE = 0, 1, 2, 3
+STATE_NAMES = {NO_SCHEDULE: "none", DUE: "due", OPEN: "open", DONE: "done"}
+
+DAY = 24 * 60   # minutes
+
+
+def evaluate_patient(minutes, idx, day, now_min, lock_minutes, given=False):
+    """
+    Reference per-patient evaluation: the same walk refresh_patient_schedule()
+    makes, without its side effects. The patient is on slot `idx` of `day`
+    (days relative to today: -1 yesterday, 1 tomorrow) and it is `now_min`
+    minutes into today; `given` is whether that first slot was given.
+    Returns (state, next_index, next_day, missed, overdue_minutes):
+      due  — next dose later today       (CASE 1)
+      open — inside the give window      (CASE 2)
+      done — nothing left today, next is on a later day
+    `missed` counts the slots walked past without being given (CASE 3) and
+    `overdue_minutes` is the time since the first of them.
+    """
+    n = len(minutes)
+    if not n:
+        return NO_SCHEDULE, 0, 0, 0, 0
+    if not 0 <= idx < n:
+        idx = 0
+
+    missed, first, step = 0, None, 0
+    while True:
+        at = day * DAY + minutes[idx]
+        if now_min <= at + lock_minutes:
+            state = DONE if day > 0 else OPEN if at <= now_min else DUE
+            return state, idx, day, missed, now_min - first if missed else 0
+        if not (step == 0 and given):
+            missed += 1
+            if first is None:
+                first = at
+        step += 1
+        idx += 1
+        if idx == n:        # CASE 4: the day's last dose, on to the next day
+            idx, day = 0, day + 1
+
+
+class WardPack:
+    """
+    Flat arrays for a fixed set of patients and their compiled schedules.
+    Re-pack whenever a schedule changes; current_index is passed per call.
+    """
+
+    def __init__(self, patient_ids, schedules):
+        self.patient_ids = list(patient_ids)
+        self.schedules = [schedules[pid] for pid in self.patient_ids]
+        lengths = [len(s) for s in self.schedules]
+        flat = [m for s in self.schedules for m in s.minutes]
+
+        if HAVE_NUMPY:
+            self.lengths = np.asarray(lengths, dtype=np.int64)
+            self.offsets = np.zeros(len(lengths), dtype=np.int64)
+            if len(lengths) > 1:
+                np.cumsum(self.lengths[:-1], out=self.offsets[1:])
+            self.minutes = np.asarray(flat, dtype=np.int64)
+            # slot -> owning patient, and slot position within that patient
+            self.owner = np.repeat(np.arange(len(lengths), dtype=np.int64), self.lengths)
+            self.local = np.arange(len(flat), dtype=np.int64) - self.offsets[self.owner]
+            self.nonempty = self.lengths > 0
+        else:
+            self.lengths = lengths
+
+    def __len__(self):
+        return len(self.patient_ids)
+
+
+def evaluate_ward(pack, current_index, current_day, now_min, lock_minutes, given=None):
+    """
+    Evaluates every patient in `pack` at `now_min` minutes into today, each
+    from its (current_index, current_day) as evaluate_patient() takes them;
+    `given` optionally flags patients whose current slot was given.
+    Returns (state, next_index, next_day, missed, overdue) as equal-length
+    sequences (NumPy arrays when available).
+    """
+    if given is None:
+        given = [False] * len(pack)
+    if not HAVE_NUMPY:
+        results = [
+            evaluate_patient(s.minutes, idx, day, now_min, lock_minutes, g)
+            for s, idx, day, g in zip(pack.schedules, current_index, current_day, given)
+        ]
+        return tuple(list(col) for col in zip(*results)) if results else ([], [], [], [], [])
+
+    n_pat = len(pack)
+    L = pack.lengths
+    idx = np.asarray(current_index, dtype=np.int64)
+    idx = np.where((idx >= 0) & (idx < L), idx, 0)
+    day = np.asarray(current_day, dtype=np.int64)
+    given = np.asarray(given, dtype=bool)
+
+    state = np.full(n_pat, NO_SCHEDULE, dtype=np.int8)
+    next_index = np.zeros(n_pat, dtype=np.int64)
+    next_day = np.zeros(n_pat, dtype=np.int64)
+    missed = np.zeros(n_pat, dtype=np.int64)
+    overdue = np.zeros(n_pat, dtype=np.int64)
+    if not len(pack.minutes):
+        return state, next_index, next_day, missed, overdue
+
+    # The walk meets slot j first on `base` (the current day, or the next
+    # one for slots before current_index) and then once a day. It stops at
+    # the first slot whose window hasn't locked (at >= now - lock), so slot
+    # j is walked past `skip` times and the stop is the earliest stop time.
+    owner = pack.owner
+    base = day[owner] + (pack.local < idx[owner])
+    gap = (now_min - lock_minutes) - pack.minutes - DAY * base
+    skip = np.maximum(0, -(-gap // DAY))
+    at = DAY * (base + skip) + pack.minutes
+
+    ne = pack.nonempty
+    starts = pack.offsets[ne]
+    steps = np.add.reduceat(skip, starts)
+    stop_at = np.minimum.reduceat(at, starts)
+    owners = np.flatnonzero(ne)
+
+    # Slot minutes are unique per patient, so exactly one slot hits stop_at
+    stop_by_owner = np.zeros(n_pat, dtype=np.int64)
+    stop_by_owner[ne] = stop_at
+    hit = at == stop_by_owner[owner]
+    next_index[owner[hit]] = pack.local[hit]
+    next_day[ne] = stop_at // DAY
+
+    state[ne] = np.where(next_day[ne] > 0, DONE, np.where(stop_at <= now_min, OPEN, DUE))
+
+    # A given current slot is walked past without counting as missed; the
+    # first missed one is then the slot after it
+    g = given[ne] & (steps > 0)
+    missed[ne] = steps - g
+    L_ne, idx_ne, day_ne, off_ne = L[ne], idx[ne], day[ne], pack.offsets[ne]
+    after = idx_ne + g
+    first_missed = DAY * (day_ne + after // L_ne) + pack.minutes[off_ne + after % L_ne]
+    overdue[ne] = np.where(missed[ne] > 0, now_min - first_missed, 0)
+    return state, next_index, next_day, missed, overdue
+
+
+# ----------------------------- BENCHMARK -----------------------------
+
+def _benchmark(n_patients=10000, seed=7):
+    import random
+    import time
+    from backend.schedule import compile_schedule, format_minutes
+
+    rng = random.Random(seed)
+    schedules, indices, days, given = {}, [], [], []
+    for i in range(n_patients):
+        k = rng.choice([0, 1, 2, 3, 4, 5, 6, 8])
+        times = [format_minutes(rng.randrange(24 * 60)) for _ in range(k)]
+        schedules[f"P{i:05d}"] = compile_schedule(times)
+        indices.append(rng.randrange(max(k, 1)))
+        days.append(rng.choice([-3, -1, 0, 0, 0, 1]))
+        given.append(rng.random() < 0.3)
+
+    t0 = time.perf_counter()
+    pack = WardPack(schedules.keys(), schedules)
+    t_pack = time.perf_counter() - t0
+
+    lock = 2
+    mismatches = 0
+    t_vec = t_ref = 0.0
+    for now_min in range(0, 24 * 60, 37):
+        t0 = time.perf_counter()
+        vec = evaluate_ward(pack, indices, days, now_min, lock, given)
+        t_vec += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        ref = [evaluate_patient(s.minutes, i, d, now_min, lock, g)
+               for s, i, d, g in zip(pack.schedules, indices, days, given)]
+        t_ref += time.perf_counter() - t0
+
+        for row, expected in enumerate(ref):
+            got = tuple(int(col[row]) for col in vec)
+            if got != expected:
+                mismatches += 1
+
+    runs = len(range(0, 24 * 60, 37))
+    print(f"patients: {n_patients}  slots: {sum(len(s) for s in schedules.values())}"
+          f"  numpy: {HAVE_NUMPY}")
+    print(f"pack:        {t_pack * 1000:8.2f} ms")
+    print(f"vectorized:  {t_vec / runs * 1000:8.2f} ms per ward evaluation")
+    print(f"per-patient: {t_ref / runs * 1000:8.2f} ms per ward evaluation")
+    print(f"mismatches:  {mismatches}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(1 if _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000) else 0)